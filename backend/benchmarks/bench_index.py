@@ -0,0 +1,60 @@
+"""Latency of the persistent vs ephemeral index modes for a single generation (index -> query -> delete)
+
+Embeddings are faked (deterministic hash vectors), so the numbers show only the vector store overhead,
+the embedding calls to ollama cost the same in every mode.
+
+usage (from the backend folder):
+    python -m benchmarks.bench_index
+"""
+from statistics import median
+import random
+import tempfile
+import time
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from services.llm_cache import LLMResponseCache
+from services.rag import RAGService, INDEX_MODES
+
+WORDS = "memory spaced repetition interval review card learning recall forgetting curve easiness factor algorithm".split()
+
+
+def make_chunks(n : int) -> list:
+    rng = random.Random(n)
+    return [Document(page_content=" ".join(rng.choice(WORDS) for _ in range(140))) for _ in range(n)]
+
+
+def run_once(rag_service : RAGService, chunks : list, mode : str, name : str) -> float:
+    started = time.perf_counter()
+
+    if mode == "persistent":
+        rag_service.index_documents(chunks, name)
+        rag_service.build_context(name, query="key definitions", token_budget=6000)
+        rag_service.delete_collection(name)
+    else:
+        vector_store = rag_service.index_documents(chunks, name, mode=mode)
+        rag_service.build_context(name, query="key definitions", token_budget=6000, vector_store=vector_store)
+        vector_store.delete_collection()
+
+    return time.perf_counter() - started
+
+
+def main(sizes=(20, 100, 500), repeats : int = 5):
+    with tempfile.TemporaryDirectory() as tmp:
+        rag_service = RAGService(persist_directory=f"{tmp}/chroma_db", cache=LLMResponseCache(path=f"{tmp}/llm_cache.db"))
+        rag_service.embedding_function = DeterministicFakeEmbedding(size=4096) # llama3.1 embedding size
+
+        print(f"{'chunks':>8} " + " ".join(f"{mode:>12}" for mode in INDEX_MODES) + "   (median ms)")
+        for n in sizes:
+            chunks = make_chunks(n)
+            timings = []
+            for mode in INDEX_MODES:
+                runs = [run_once(rag_service, chunks, mode, f"bench_{mode}_{n}_{i}") for i in range(repeats)]
+                timings.append(median(runs) * 1000)
+
+            print(f"{n:>8} " + " ".join(f"{t:>12.1f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
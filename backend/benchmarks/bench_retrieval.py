@@ -0,0 +1,59 @@
+"""Latency and recall of the vector / hybrid / lexical retrieval modes of build_context
+
+Synthetic article: filler chunks plus a few planted definitions of made-up terms, every query asks
+for one definition. Embeddings are faked (deterministic hash vectors), i.e. the worst possible "weak embedder",
+so the vector-only recall is a lower bound and the latency excludes the ollama embedding call.
+
+usage (from the backend folder):
+    python -m benchmarks.bench_retrieval
+"""
+from statistics import median
+import random
+import tempfile
+import time
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from services.llm_cache import LLMResponseCache
+from services.rag import RAGService, RETRIEVAL_MODES
+
+WORDS = "memory spaced repetition interval review card learning recall forgetting curve easiness factor algorithm".split()
+
+
+def make_article(n_chunks : int, n_terms : int, seed : int = 0):
+    rng = random.Random(seed)
+    terms = [f"term{rng.randrange(10**6)}x" for _ in range(n_terms)]
+
+    chunks = [Document(page_content=" ".join(rng.choice(WORDS) for _ in range(140))) for _ in range(n_chunks)]
+    for term in terms:
+        filler = " ".join(rng.choice(WORDS) for _ in range(100))
+        chunks.insert(rng.randrange(len(chunks)), Document(page_content=f"{filler}. {term.capitalize()} is defined as {filler[:80]}.", metadata={"term": term}))
+
+    return chunks, terms
+
+
+def main(n_chunks : int = 300, n_terms : int = 30, token_budget : int = 1500):
+    with tempfile.TemporaryDirectory() as tmp:
+        rag_service = RAGService(persist_directory=f"{tmp}/chroma_db", cache=LLMResponseCache(path=f"{tmp}/llm_cache.db"))
+        rag_service.embedding_function = DeterministicFakeEmbedding(size=4096)
+
+        chunks, terms = make_article(n_chunks, n_terms)
+        vector_store = rag_service.index_documents(chunks, "bench_retrieval", mode="numpy")
+
+        print(f"{'mode':>8} {'median ms':>10} {'recall':>8}")
+        for mode in RETRIEVAL_MODES:
+            timings = []
+            hits = 0
+            for term in terms:
+                started = time.perf_counter()
+                docs = rag_service.build_context("bench_retrieval", query=f"key definition of {term}", token_budget=token_budget,
+                                                 vector_store=vector_store, retrieval_mode=mode)
+                timings.append(time.perf_counter() - started)
+                hits += any(doc.metadata.get("term") == term for doc in docs)
+
+            print(f"{mode:>8} {median(timings) * 1000:>10.2f} {hits / len(terms):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
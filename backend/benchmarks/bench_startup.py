@@ -0,0 +1,60 @@
+"""Import time and RSS of the API process
+
+Every variant runs in a fresh interpreter:
+    study        - WIKICARD_API_MODE=study, the RAG stack must never be imported
+    full         - default process right after startup (RAG stack not imported yet, it's lazy)
+    full + rag   - the same after the first generation imported services.rag
+
+usage (from the backend folder):
+    python -m benchmarks.bench_startup
+"""
+import json
+import os
+import subprocess
+import sys
+
+SCRIPT = """
+import json, sys, time
+import psutil
+started = time.perf_counter()
+import main
+if {import_rag}:
+    import services.rag
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": psutil.Process().memory_info().rss / 2**20,
+    "langchain_loaded": any(name.startswith("langchain") for name in sys.modules),
+    "modules": len(sys.modules)
+}}))
+"""
+
+VARIANTS = (
+    ("study", "study", False),
+    ("full", "full", False),
+    ("full + rag", "full", True),
+)
+
+
+def measure(api_mode : str, import_rag : bool, repeats : int = 3) -> dict:
+    env = dict(os.environ, WIKICARD_API_MODE=api_mode, WIKICARD_WARM_UP="0")
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(import_rag=import_rag)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def main():
+    print(f"{'variant':>12} {'import s':>9} {'RSS MB':>11} {'langchain':>10} {'modules':>8}")
+    for name, api_mode, import_rag in VARIANTS:
+        result = measure(api_mode, import_rag)
+        print(f"{name:>12} {result['seconds']:>9.2f} {result['rss_mb']:>11.1f} {str(result['langchain_loaded']):>10} {result['modules']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Throughput and peak memory of the streaming export and the batched import
+
+A user with n cards (spread over decks of 500) and 3 review logs per card is imported from NDJSON,
+then exported in every format. Runs against a temporary SQLite file, not database.db.
+
+usage (from the backend folder):
+    python -m benchmarks.bench_transfer [--cards 100000] [--batch-size 5000] [--trace-memory]
+
+--trace-memory reports the peak python allocations (tracemalloc slows everything down ~3x, so timings are off then)
+"""
+from datetime import datetime, timezone, timedelta
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from sqlmodel import SQLModel, Session, create_engine, select, func
+
+import database # noqa: F401 - registers the sqlite pragmas
+from models import User, Flashcard
+from services.transfer import export_ndjson, export_cards_csv, export_reviews_csv, export_anki, import_ndjson
+
+DECK_SIZE = 500
+REVIEWS_PER_CARD = 3
+
+
+def make_ndjson(path : str, cards : int):
+    rng = random.Random(cards)
+    started = datetime.now(timezone.utc) - timedelta(days=90)
+
+    with open(path, "w", encoding="utf-8") as file:
+        for deck_id in range(cards // DECK_SIZE + 1):
+            file.write(json.dumps({"type": "deck", "id": deck_id, "title": f"Deck {deck_id}", "status": "active"}) + "\n")
+        for card_id in range(cards):
+            file.write(json.dumps({"type": "card", "id": card_id, "deck_id": card_id // DECK_SIZE,
+                                   "front": f"Question {card_id} " + "x" * 60, "back": f"Answer {card_id} " + "y" * 120}) + "\n")
+        for card_id in range(cards):
+            for review in range(REVIEWS_PER_CARD):
+                file.write(json.dumps({"type": "review", "card_id": card_id,
+                                       "review_date": (started + timedelta(days=10 * review)).isoformat(), "grade": rng.randint(2, 5),
+                                       "resulting_interval": review * 3 + 1, "resulting_easiness_factor": 2.5}) + "\n")
+
+
+def measure(name : str, rows : int, run, trace_memory : bool):
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    size = run()
+    elapsed = time.perf_counter() - started
+
+    peak = "-"
+    if trace_memory:
+        peak = f"{tracemalloc.get_traced_memory()[1] / 2**20:.1f}"
+        tracemalloc.stop()
+    print(f"{name:>16} {elapsed:>8.2f} {rows / elapsed:>12.0f} {peak:>10} {size / 2**20:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cards", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as session:
+            session.add(User(id=1, username="bench", email="bench@example.com"))
+            session.commit()
+
+        source = os.path.join(tmp, "source.ndjson")
+        make_ndjson(source, args.cards)
+        print(f"{args.cards} cards, {args.cards * REVIEWS_PER_CARD} review logs, batch size {args.batch_size}")
+        print(f"{'step':>16} {'seconds':>8} {'cards/s':>12} {'peak MB':>10} {'file MB':>9}")
+
+        def run_import():
+            with Session(engine) as session, open(source, encoding="utf-8") as file:
+                import_ndjson(session, 1, file, batch_size=args.batch_size)
+            return os.path.getsize(source)
+
+        measure("import ndjson", args.cards, run_import, args.trace_memory)
+
+        for name, export in (("export ndjson", export_ndjson), ("export csv", export_cards_csv),
+                             ("export reviews", export_reviews_csv), ("export anki", export_anki)):
+            def run_export():
+                with Session(engine) as session:
+                    return sum(len(chunk) for chunk in export(session, 1, batch_size=args.batch_size))
+            measure(name, args.cards, run_export, args.trace_memory)
+
+        with Session(engine) as session:
+            assert session.exec(select(func.count(Flashcard.id))).one() == args.cards
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from sqlmodel import SQLModel, create_engine, Session
-from sqlalchemy import event
+from sqlalchemy import event, inspect, text
 from sqlalchemy.engine import Engine
 
 sqlite_file_name = "database.db"
@@ -12,10 +12,31 @@ engine = create_engine(sqlite_url, connect_args=connect_args)
 def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL") # only takes effect on a new db, services.maintenance converts old ones
+    cursor.execute("PRAGMA journal_mode=WAL") # API + generation worker processes write concurrently
     cursor.close()
 
+def _add_missing_columns():
+    """create_all doesn't alter existing tables - nullable (or server default) columns added to a model later are added here"""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                definition = f"{column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    definition += f" NOT NULL DEFAULT {column.server_default.arg}"
+                elif not column.nullable:
+                    continue
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    _add_missing_columns()
 
 def get_Session():
     with Session(engine) as session:
@@ -0,0 +1,239 @@
+"""Offline bulk ingestion of a local Wikipedia XML dump (plain, .bz2 or .gz)
+
+Streams the dump page by page, parses wikitext in a process pool and runs every article through
+the chunk / index / generate stages of RAGService. Progress is checkpointed, so an interrupted run
+can be resumed with the same command. Articles whose generation failed are kept in the checkpoint and
+retried on resume, after --max-failures failures in a row (ollama down) the run stops.
+
+usage (from the backend folder):
+    python ingest.py enwiki-latest-pages-articles1.xml.bz2 --user-id 1 --workers 4
+"""
+from typing import Iterator, Dict, Any, Optional, Set
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import xml.etree.ElementTree as ET
+import argparse
+import bz2
+import gzip
+import json
+import os
+import time
+
+from langchain_core.documents import Document
+from sqlmodel import Session
+
+from database import engine, create_db_and_tables
+from models import Deck, Flashcard, DeckStatus
+from services.rag import RAGService
+from services.generation import build_rag_service
+from services.versions import versions
+from services.wikitext import parse_page
+
+
+def open_dump(path : str):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def _local(tag : str) -> str:
+    """Tag name without the mediawiki export namespace"""
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_pages(path : str) -> Iterator[Dict[str, Any]]:
+    """Streams main namespace articles from the dump with bounded memory (parsed elements are cleared)"""
+    with open_dump(path) as f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+
+        ordinal = 0
+        for event, elem in context:
+            if event != "end" or _local(elem.tag) != "page":
+                continue
+
+            page = {"ordinal": ordinal, "redirect": False}
+            for child in elem.iter():
+                name = _local(child.tag)
+                if name == "title":
+                    page["title"] = child.text or ""
+                elif name == "ns":
+                    page["ns"] = child.text
+                elif name == "id" and "id" not in page:
+                    page["id"] = int(child.text)
+                elif name == "redirect":
+                    page["redirect"] = True
+                elif name == "revision":
+                    page["revision_id"] = int(child.findtext("{*}id") or 0) or None
+                elif name == "text":
+                    page["text"] = child.text or ""
+
+            ordinal += 1
+            root.clear()
+
+            if page.get("ns") != "0" or page["redirect"] or page.get("text", "").lstrip().upper().startswith("#REDIRECT"):
+                continue
+            yield page
+
+
+class Checkpoint:
+    """Number of dump pages already consumed and ordinals of the failed articles, written atomically after every article"""
+    def __init__(self, path : str):
+        self.path = path
+        self.pages_consumed = 0
+        self.articles_done = 0
+        self.failed : Set[int] = set() # retried on resume
+
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.pages_consumed = state["pages_consumed"]
+            self.articles_done = state["articles_done"]
+            self.failed = set(state.get("failed", []))
+
+    def pending(self, ordinal : int) -> bool:
+        return ordinal >= self.pages_consumed or ordinal in self.failed
+
+    def save(self, ordinal : int, title : str, failed : bool = False):
+        # retried articles come before pages_consumed, it never goes back
+        self.pages_consumed = max(self.pages_consumed, ordinal + 1)
+        if failed:
+            self.failed.add(ordinal)
+        else:
+            self.failed.discard(ordinal)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"pages_consumed": self.pages_consumed, "articles_done": self.articles_done, "failed": sorted(self.failed),
+                       "last_title": title}, f)
+        os.replace(tmp_path, self.path)
+
+
+def ingest_article(rag_service : RAGService, article : Dict[str, Any], user_id : int, deck_size : int) -> int:
+    """Chunk / index / generate for one parsed article, saves an active deck, returns the number of cards"""
+    docs = [
+        Document(page_content=text, metadata={"title": article["title"], "section": section, "revision_id": article["revision_id"]})
+        for section, text in article["sections"]
+    ]
+    chunks = rag_service.chunk_documents(docs)
+
+    with Session(engine) as session:
+        deck = Deck(
+            title=article["title"],
+            description=f"Generated from Wikipedia dump: {article['title']} (revision {article['revision_id']})",
+            user_id=user_id,
+            status=DeckStatus.DRAFT
+        )
+        session.add(deck)
+        session.commit()
+        session.refresh(deck)
+
+        try:
+            cards = rag_service.generate_deck_cards(chunks, title=article["title"], collection_name=f"deck_{deck.id}", deck_size=deck_size,
+                                                   index_mode="numpy")
+        except Exception:
+            session.delete(deck)
+            session.commit()
+            raise
+
+        for card in cards:
+            session.add(Flashcard(front=card["front"], back=card["back"], deck_id=deck.id))
+        deck.status = DeckStatus.ACTIVE
+        session.add(deck)
+        versions.bump_deck(session, deck.id, deck.user_id)
+        session.commit()
+
+    return len(cards)
+
+
+def run(dump_path : str, user_id : int, deck_size : int, workers : int, checkpoint_path : str, limit : Optional[int], min_chars : int,
+        max_failures : int = 5):
+    create_db_and_tables()
+    rag_service = build_rag_service()
+    checkpoint = Checkpoint(checkpoint_path)
+    if checkpoint.pages_consumed:
+        print(f"Resuming after {checkpoint.pages_consumed} pages ({checkpoint.articles_done} articles done, "
+              f"{len(checkpoint.failed)} failed ones to retry)")
+
+    started = time.monotonic()
+    processed = 0
+    failed = 0
+    failed_in_row = 0
+    submitted = 0
+
+    # parsing runs ahead of generation, but only a bounded number of pages is in flight
+    max_in_flight = workers * 4
+    pending = deque()
+
+    def consume(future) -> bool:
+        """Ingests one parsed article, returns False when the run should stop"""
+        nonlocal processed, failed, failed_in_row
+        article = future.result()
+
+        article_failed = False
+        if sum(len(text) for _, text in article["sections"]) >= min_chars:
+            try:
+                cards = ingest_article(rag_service, article, user_id, deck_size)
+                checkpoint.articles_done += 1
+                processed += 1
+                failed_in_row = 0
+                print(f"[{checkpoint.articles_done}] {article['title']}: {cards} cards")
+            except Exception as e:
+                failed += 1
+                failed_in_row += 1
+                article_failed = True
+                print(f"Failed to ingest {article['title']}: {e}")
+
+        # a failed article is recorded as such, the next run retries it
+        checkpoint.save(article["ordinal"], article["title"], failed=article_failed)
+
+        if processed and processed % 10 == 0:
+            rate = processed / ((time.monotonic() - started) / 60)
+            print(f"Throughput: {rate:.1f} articles/minute")
+
+        if max_failures and failed_in_row >= max_failures:
+            print(f"{failed_in_row} articles failed in a row (is ollama running?), stopping - run the same command again to resume")
+            return False
+        return True
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = True
+        for page in iter_pages(dump_path):
+            if not checkpoint.pending(page["ordinal"]):
+                continue
+            if limit is not None and submitted >= limit:
+                break
+
+            pending.append(executor.submit(parse_page, page))
+            submitted += 1
+            if len(pending) >= max_in_flight:
+                running = consume(pending.popleft())
+                if not running:
+                    break
+
+        # pages parsed ahead of a stop are not checkpointed, the next run starts with them
+        while running and pending:
+            running = consume(pending.popleft())
+        for future in pending:
+            future.cancel()
+
+    minutes = (time.monotonic() - started) / 60
+    rate = processed / minutes if minutes else 0.0
+    print(f"Done: {processed} articles, {failed} failed in {minutes:.1f} min ({rate:.1f} articles/minute)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate decks from a local Wikipedia XML dump")
+    parser.add_argument("dump", help="path to the dump (.xml, .xml.bz2 or .xml.gz)")
+    parser.add_argument("--user-id", type=int, required=True, help="owner of the generated decks")
+    parser.add_argument("--deck-size", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="wikitext parsing processes")
+    parser.add_argument("--checkpoint", default="ingest_checkpoint.json")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many articles (redirects and other namespaces don't count)")
+    parser.add_argument("--min-chars", type=int, default=500, help="skip stubs shorter than this")
+    parser.add_argument("--max-failures", type=int, default=5, help="stop after this many failed articles in a row (0 = never)")
+    args = parser.parse_args()
+
+    run(args.dump, args.user_id, args.deck_size, args.workers, args.checkpoint, args.limit, args.min_chars, args.max_failures)
@@ -1,14 +1,63 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager, suppress
+import asyncio
+
+import settings
 from database import create_db_and_tables
-from routers import decks, study
+from routers import decks, study, transfer, maintenance as maintenance_router
+from services.lifecycle import ModelWarmer
+from services.worker_pool import WorkerPool
+from services.maintenance import maintenance
+
+model_warmer = ModelWarmer(settings.MODEL_NAME, keep_alive=settings.MODEL_KEEP_ALIVE)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
+
+    # load the models in the background, /ready reports 503 until both are warm
+    warm_up_task = None
+    if settings.WARM_UP_MODELS:
+        warm_up_task = asyncio.create_task(model_warmer.run(settings.MODEL_HEARTBEAT_SECONDS))
+
+    # generation runs in separate processes, this one stays free for the study endpoints
+    generation_pool = None
+    if settings.GENERATION_WORKERS > 0 and settings.API_MODE != "study":
+        generation_pool = WorkerPool(
+            settings.GENERATION_WORKERS,
+            poll_interval=settings.WORKER_POLL_SECONDS,
+            memory_limit_mb=settings.WORKER_MEMORY_LIMIT_MB,
+            max_jobs=settings.WORKER_MAX_JOBS,
+            lease_seconds=settings.WORKER_LEASE_SECONDS,
+            max_attempts=settings.WORKER_MAX_ATTEMPTS,
+            per_user_concurrency=settings.USER_GENERATION_CONCURRENCY
+        )
+        generation_pool.start()
+    app.state.generation_pool = generation_pool
+
+    # periodic garbage collection of stale decks, orphaned collections and free db pages
+    maintenance_task = None
+    # not in the study-only process, a full API process (the one holding the maintenance lock) does it
+    if settings.MAINTENANCE_INTERVAL_SECONDS > 0 and settings.API_MODE != "study":
+        maintenance_task = asyncio.create_task(maintenance.run(settings.MAINTENANCE_INTERVAL_SECONDS))
+
     yield
 
+    if maintenance_task:
+        maintenance_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await maintenance_task
+
+    if generation_pool:
+        generation_pool.stop()
+
+    if warm_up_task:
+        warm_up_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await warm_up_task
+
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
@@ -23,5 +72,18 @@ app.add_middleware(
 def read_root():
     return {"message": "Welcome to the WikiCard AI - RAG-Powered Flashcard Generation App API"}
 
+@app.get("/ready")
+def readiness():
+    """Readiness probe - 200 only when the chat and embedding models are loaded"""
+    report = model_warmer.report()
+    report["api_mode"] = settings.API_MODE
+    if not settings.WARM_UP_MODELS:
+        report["ready"] = True # nothing to wait for (study-only process or warm-up disabled)
+    elif not report["ready"]:
+        return JSONResponse(status_code=503, content=report)
+    return report
+
 app.include_router(decks.router)
 app.include_router(study.router)
+app.include_router(transfer.router)
+app.include_router(maintenance_router.router)
@@ -9,6 +9,12 @@ class DeckStatus(str, Enum):
     ARCHIVED = "archived"
     DRAFT = "draft"  # for decks that are generated but not saved yet
 
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
 class User(SQLModel, table=True):
     id : Optional[int] = Field(default=None, primary_key=True)
     username : str = Field(index=True)
@@ -58,4 +64,43 @@ class ReviewLog(SQLModel, table=True):
     flashcard: Optional[Flashcard] = Relationship(back_populates="review_logs")
 
 
+class ArticleIndex(SQLModel, table=True):
+    """Persistent vector index of a Wikipedia article, shared by all decks generated from it"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    url: str = Field(index=True, unique=True)
+    title: Optional[str] = None
+    collection_name: str # chroma collection, its ids are content hashes of the chunks
+    revision_id: Optional[int] = None # wikipedia revision the index was built from
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class DeckArticleLink(SQLModel, table=True):
+    """Which article index a deck was generated from"""
+    deck_id: int = Field(foreign_key="deck.id", primary_key=True, ondelete="CASCADE")
+    article_id: int = Field(foreign_key="articleindex.id", index=True, ondelete="CASCADE")
+
+
+class GenerationJob(SQLModel, table=True):
+    """Queue of deck generations for the worker processes (SQLite-backed)"""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: JobStatus = Field(default=JobStatus.QUEUED, index=True)
+    payload: str # GenerateRequest as JSON, or {"kind": "refresh", "regenerate": ...}
+    user_id: int = Field(index=True)
+    deck_id: Optional[int] = None # draft deck filled by the job (deleted again if a generation fails) / deck to refresh
+    error: Optional[str] = None
+    result: Optional[str] = None # JSON summary of a refresh job
+    worker_pid: Optional[int] = None
+    lease_expires_at: Optional[datetime] = None # extended by the worker while it runs, an expired lease = dead worker
+    attempts: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) # claims so far, a job killing its workers isn't retried forever
+
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class DataVersion(SQLModel, table=True):
+    """Version counters behind the ETags (services/versions.py), bumped in the transaction of the write"""
+    scope: str = Field(primary_key=True) # "user:<id>" or "deck:<id>"
+    version: int = Field(default=0)
+
+
 # https://sqlmodel.tiangolo.com/tutorial/relationship-attributes/cascade-delete-relationships/#using-cascade_delete-or-ondelete
\ No newline at end of file
@@ -1,18 +1,92 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, Response
 from sqlmodel import Session, select
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import List, Optional, Literal, TYPE_CHECKING
+from contextlib import contextmanager
+import threading
+import json
+import math
+from pydantic import BaseModel, Field
 
+import settings
 from database import get_Session
-from models import Deck, Flashcard, DeckStatus, User
-from services.rag import RAGService
+from models import Deck, Flashcard, DeckStatus, User, DeckArticleLink, GenerationJob, JobStatus
+from services.generation import run_generation, run_refresh, build_rag_service
+from services.worker_pool import enqueue_job, wait_for_job
+from services.scheduler import FairScheduler, RateLimitExceeded, QueueTimeout, QueueFull
+from services.due_queue import due_queues
+from services.versions import versions, etag_matches
+from services.llm_cache import LLMResponseCache
+from services.structured import GenerationStats
+
+if TYPE_CHECKING:
+    from services.rag import RAGService
 
 router = APIRouter(prefix="/decks", tags=["decks"])
-rag_service = RAGService()
+
+# the RAG stack (langchain, chroma, ollama clients) is imported on the first generation, not at startup
+_rag_service = None
+_rag_service_lock = threading.Lock()
+
+# same as SINGLE_PROMPT_DECK_SIZE in services.rag, not imported from there to keep the RAG stack lazy
+DEFAULT_DECK_SIZE = 5
+
+def get_rag_service() -> "RAGService":
+    global _rag_service
+    if settings.API_MODE == "study":
+        raise HTTPException(status_code=503, detail="Deck generation is disabled in the study-only API process")
+
+    if _rag_service is None:
+        with _rag_service_lock:
+            if _rag_service is None:
+                _rag_service = build_rag_service()
+
+    return _rag_service
+
+# the stats endpoints read the counters every process writes to the cache file, no RAG stack needed for that
+_stats_store = None
+
+def get_stats_store() -> LLMResponseCache:
+    global _stats_store
+    if _stats_store is None:
+        with _rag_service_lock:
+            if _stats_store is None:
+                _stats_store = LLMResponseCache(settings.LLM_CACHE_PATH)
+    return _stats_store
+
+generation_scheduler = FairScheduler(
+    max_concurrency=settings.GENERATION_MAX_CONCURRENCY,
+    per_user_concurrency=settings.USER_GENERATION_CONCURRENCY,
+    rate_per_minute=settings.USER_GENERATIONS_PER_MINUTE,
+    burst=settings.USER_GENERATION_BURST,
+    max_queue=settings.GENERATION_MAX_QUEUE
+)
+
+def uses_workers() -> bool:
+    return settings.GENERATION_WORKERS > 0 and settings.API_MODE != "study"
+
+@contextmanager
+def generation_slot(user_id: int, cost: int):
+    """Waits for a fair share of the ollama backend - 429 when rate limited, 503 when the queue is full or the wait too long"""
+    try:
+        generation_scheduler.acquire(user_id, cost=cost, timeout=settings.GENERATION_QUEUE_TIMEOUT)
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except (QueueFull, QueueTimeout) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    try:
+        yield
+    finally:
+        generation_scheduler.release(user_id)
 
 class GenerateRequest(BaseModel):
     url: str
     user_id: int
+    deck_size: int = Field(default=DEFAULT_DECK_SIZE, ge=1, le=200)
+    latency_budget: float = Field(default=180.0, gt=0) # seconds, only for map-reduce generation
+    fresh: bool = False # bypass the LLM response cache
+    index_mode: Literal["persistent", "memory", "numpy"] = "persistent" # ephemeral modes skip the article index (no refresh later)
+    retrieval_mode: Literal["hybrid", "vector", "lexical"] = "hybrid"
 
 class DeckResponse(BaseModel):
     id: int
@@ -20,9 +94,7 @@ class DeckResponse(BaseModel):
     status: str
     flashcards: List[dict]
 
-@router.post("/generate", response_model=DeckResponse)
-def generate_deck(request: GenerateRequest, session: Session = Depends(get_Session)):
-    # create a draft deck
+def create_draft_deck(session: Session, request: GenerateRequest) -> Deck:
     # TODO: later - fetch real title from URL or scrape it
     deck = Deck(
         title=f"Draft from {request.url}",
@@ -33,50 +105,51 @@ def generate_deck(request: GenerateRequest, session: Session = Depends(get_Sessi
     session.add(deck)
     session.commit()
     session.refresh(deck)
-    
+    return deck
 
-    try:
-        docs = rag_service.scrape_and_load(request.url)
-        wiki_title = docs[0].metadata.get('title', 'Wikipedia Page').strip()
+def generation_cost(request: GenerateRequest) -> int:
+    """Big (map-reduce) decks take several LLM calls, so they cost more rate limit tokens"""
+    return math.ceil(request.deck_size / DEFAULT_DECK_SIZE)
 
-        chunks = rag_service.chunk_documents(docs)
-        collection_name = f"deck_{deck.id}"
-        
-        # topic = "the content" 
-        
-        # index
-        rag_service.index_documents(chunks, collection_name)
-        
-        # generate
-        generated_cards = rag_service.generate_flashcards(collection_name, topic=f"Create 5 flashcards about {wiki_title}")
-        
-        # save our flashcard to db
-        created_cards = []
-        for card in generated_cards:
-            flashcard = Flashcard(
-                front=card.get("front", "Error"),
-                back=card.get("back", "Error"),
-                deck_id=deck.id,
-
-                # SM-2 default vals
-                easiness_factor=2.5,
-                interval=0,
-                repetitions=0
-            )
-            session.add(flashcard)
-            created_cards.append(flashcard)
-            
-        session.commit()
-        
-        # chroma db cleanup
-        rag_service.delete_collection(collection_name)
-        
-        return {
-            "id": deck.id,
-            "title": deck.title,
-            "status": deck.status,
-            "flashcards": [{"front": c.front, "back": c.back, "id": c.id} for c in created_cards]
-        }
+def deck_response(deck: Deck, cards: List[Flashcard]) -> dict:
+    return {
+        "id": deck.id,
+        "title": deck.title,
+        "status": deck.status,
+        "flashcards": [{"front": c.front, "back": c.back, "id": c.id} for c in cards]
+    }
+
+@router.post("/generate", response_model=DeckResponse)
+def generate_deck(request: GenerateRequest, session: Session = Depends(get_Session)):
+    use_workers = uses_workers()
+    rag_service = None if use_workers else get_rag_service()
+
+    with generation_slot(request.user_id, cost=generation_cost(request)):
+        if use_workers:
+            return generate_in_worker(session, request)
+        return generate_in_process(session, request, rag_service)
+
+def generate_in_worker(session: Session, request: GenerateRequest) -> dict:
+    # the pipeline runs in a worker process, we only wait for it here
+    deck = create_draft_deck(session, request)
+    job = enqueue_job(session, deck, request.model_dump())
+    job = wait_for_job(job.id, timeout=settings.GENERATION_TIMEOUT_SECONDS)
+
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != JobStatus.DONE:
+        raise HTTPException(status_code=504, detail=f"Generation is still running, check /decks/jobs/{job.id}")
+
+    session.refresh(deck)
+    return deck_response(deck, deck.flashcards)
+
+def generate_in_process(session: Session, request: GenerateRequest, rag_service) -> dict:
+    # create a draft deck
+    deck = create_draft_deck(session, request)
+
+    try:
+        created_cards = run_generation(session, rag_service, deck, request.model_dump())
+        return deck_response(deck, created_cards)
         
     except Exception as e:
         # cleanup if sth failed
@@ -84,6 +157,89 @@ def generate_deck(request: GenerateRequest, session: Session = Depends(get_Sessi
         session.commit()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/jobs")
+def submit_generation_job(request: GenerateRequest, session: Session = Depends(get_Session)):
+    """Queues a generation for the worker processes and returns immediately"""
+    if not uses_workers():
+        raise HTTPException(status_code=503, detail="No generation workers configured")
+
+    # queued jobs are rate limited here, the workers pick the queue fairly across users
+    try:
+        generation_scheduler.check_rate(request.user_id, cost=generation_cost(request))
+    except RateLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+    deck = create_draft_deck(session, request)
+    job = enqueue_job(session, deck, request.model_dump())
+    return {"job_id": job.id, "deck_id": deck.id, "status": job.status}
+
+@router.get("/scheduler/stats")
+def get_scheduler_stats():
+    """Queue depth and wait times per user"""
+    return generation_scheduler.stats()
+
+@router.get("/jobs/stats")
+def get_job_stats(request: Request):
+    """Queue depth and worker liveness of the generation pool"""
+    pool = getattr(request.app.state, "generation_pool", None)
+    if pool is None:
+        raise HTTPException(status_code=503, detail="No generation workers configured")
+    return pool.stats()
+
+@router.get("/jobs/{job_id}")
+def get_generation_job(job_id: int, session: Session = Depends(get_Session)):
+    job = session.get(GenerationJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    response = {"job_id": job.id, "status": job.status, "error": job.error, "deck": None,
+                "result": json.loads(job.result) if job.result else None}
+    if job.status == JobStatus.DONE:
+        deck = session.get(Deck, job.deck_id)
+        if deck:
+            response["deck"] = deck_response(deck, deck.flashcards)
+    return response
+
+@router.get("/cache/stats")
+def get_cache_stats(store: LLMResponseCache = Depends(get_stats_store)):
+    """Hit rate of the LLM response cache (all processes)"""
+    return store.stats()
+
+@router.get("/generation/stats")
+def get_generation_stats(store: LLMResponseCache = Depends(get_stats_store)):
+    """JSON repair / retry / failure rates of the flashcard generation (all processes)"""
+    return GenerationStats(store).snapshot()
+
+@router.post("/{deck_id}/refresh")
+def refresh_deck(deck_id: int, regenerate: bool = False, session: Session = Depends(get_Session)):
+    """Re-indexes the source article of the deck if it has a new revision
+        Only added/changed chunks are embedded, with regenerate=True new cards are created from them
+    """
+    deck = session.get(Deck, deck_id)
+    if not deck:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    if not session.get(DeckArticleLink, deck_id):
+        raise HTTPException(status_code=404, detail="Deck has no indexed source article")
+
+    use_workers = uses_workers()
+    rag_service = None if use_workers else get_rag_service()
+
+    # embedding (and regenerating) goes through the same fair share of the ollama backend as a generation
+    with generation_slot(deck.user_id, cost=1):
+        if use_workers:
+            job = enqueue_job(session, deck, {"kind": "refresh", "regenerate": regenerate})
+            job = wait_for_job(job.id, timeout=settings.GENERATION_TIMEOUT_SECONDS)
+            if job.status == JobStatus.FAILED:
+                raise HTTPException(status_code=500, detail=job.error)
+            if job.status != JobStatus.DONE:
+                raise HTTPException(status_code=504, detail=f"Refresh is still running, check /decks/jobs/{job.id}")
+            return json.loads(job.result)
+
+        try:
+            return run_refresh(session, rag_service, deck, regenerate, num_cards=DEFAULT_DECK_SIZE)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
 @router.post("/{deck_id}/save")
 def save_deck(deck_id: int, session: Session = Depends(get_Session)):
     deck = session.get(Deck, deck_id)
@@ -92,7 +248,10 @@ def save_deck(deck_id: int, session: Session = Depends(get_Session)):
     
     deck.status = DeckStatus.ACTIVE
     session.add(deck)
+    version = versions.bump_deck(session, deck.id, deck.user_id)
     session.commit()
+
+    due_queues.deck_activated(deck.user_id, deck, version)
     return {"status": "success", "deck_status": deck.status}
 
 @router.post("/{deck_id}/discard")
@@ -103,24 +262,39 @@ def discard_deck(deck_id: int, session: Session = Depends(get_Session)):
 
     deck.status = DeckStatus.ARCHIVED
     session.add(deck)
+    version = versions.bump_deck(session, deck.id, deck.user_id)
     session.commit()
+    due_queues.deck_removed(deck.user_id, deck.id, version)
 
     # session.delete(deck)
     # session.commit()
     return {"status": "success", "deck_status": deck.status}
 
 @router.get("/", response_model=List[Deck])
-def list_decks(user_id: int, session: Session = Depends(get_Session)):
+def list_decks(user_id: int, request: Request, response: Response, session: Session = Depends(get_Session)):
+    etag = versions.user_etag(session, user_id)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
     statement = select(Deck).where(Deck.user_id == user_id, Deck.status == DeckStatus.ACTIVE)
     decks = session.exec(statement).all()
     return decks
 
 @router.get("/{deck_id}/cards", response_model=List[Flashcard])
-def get_deck_cards(deck_id : int, session : Session = Depends(get_Session)):
+def get_deck_cards(deck_id : int, request : Request, response : Response, session : Session = Depends(get_Session)):
+    etag = versions.deck_etag(session, deck_id)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
     deck = session.get(Deck, deck_id)
 
     if not deck:
         raise HTTPException(status_code=404, detail="Deck not found")
+
+    # drafts are still being filled (possibly by a worker process we don't hear from), no ETag for them
+    if deck.status != DeckStatus.DRAFT:
+        response.headers["ETag"] = etag
     
     return deck.flashcards
 
@@ -130,7 +304,10 @@ def delete_deck(deck_id: int, session: Session = Depends(get_Session)):
     if not deck:
         raise HTTPException(status_code=404, detail="Deck not found")
     
+    user_id = deck.user_id
     session.delete(deck)
+    version = versions.bump_deck(session, deck_id, user_id)
     session.commit()
+    due_queues.deck_removed(user_id, deck_id, version)
 
     return {"message": f"Deck: {deck_id} and all related data deleted successfully"}
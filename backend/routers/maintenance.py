@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from services.maintenance import maintenance
+
+router = APIRouter(prefix="/maintenance", tags=["maintenance"])
+
+@router.post("/run")
+async def run_maintenance():
+    """Runs the garbage collection now and returns what was removed / reclaimed"""
+    report = await run_in_threadpool(maintenance.run_once)
+    if report.get("skipped"):
+        raise HTTPException(status_code=409, detail=report["reason"])
+    return report
+
+@router.get("/report")
+def get_maintenance_report():
+    """Report of the last garbage collection run"""
+    if maintenance.last_report is None:
+        raise HTTPException(status_code=404, detail="Maintenance did not run yet")
+    return maintenance.last_report
@@ -1,12 +1,14 @@
 from datetime import datetime, timezone, timedelta
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlmodel import Session, select
 from typing import List
 from pydantic import BaseModel
 
 from database import get_Session
-from models import Flashcard, ReviewLog, Deck, DeckStatus
+from models import Flashcard, ReviewLog, DeckStatus
 from services.sm2 import SM2Algorithm
+from services.due_queue import due_queues
+from services.versions import versions, etag_matches
 
 router = APIRouter(prefix="/study", tags=["study"])
 sm2_service = SM2Algorithm()
@@ -16,19 +18,36 @@ class ReviewSubmission(BaseModel):
     grade: int # 0-5
 
 @router.get("/due")
-def get_due_cards(user_id: int, session: Session = Depends(get_Session)):
+def get_due_cards(user_id: int, request: Request, response: Response, session: Session = Depends(get_Session)):
     """Get all cards that are due for review from all active decks."""
-    now = datetime.now(timezone.utc)
-    
-    statement = (
-        select(Flashcard)
-        .join(Deck)
-        .where(Deck.user_id == user_id)
-        .where(Deck.status == DeckStatus.ACTIVE)
-        .where(Flashcard.next_review_date <= now)
-    )
-    cards = session.exec(statement).all()
-    return cards
+    # ids come from the in-memory queue (most overdue first), only those cards are read from the db
+    card_ids = due_queues.due_cards(session, user_id)
+
+    # without a write the due set only grows with time, so the version + number of due cards identifies it
+    etag = versions.user_etag(session, user_id, suffix=f"-{len(card_ids)}")
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    if not card_ids:
+        return []
+
+    cards = {card.id: card for card in session.exec(select(Flashcard).where(Flashcard.id.in_(card_ids))).all()}
+    return [cards[card_id] for card_id in card_ids if card_id in cards]
+
+@router.get("/due/count")
+def get_due_count(user_id: int, session: Session = Depends(get_Session)):
+    """Number of due cards and when the next one becomes due (no db query once the queue is loaded)"""
+    return due_queues.summary(session, user_id)
+
+@router.get("/due/check")
+def check_due_queue(user_id: int, session: Session = Depends(get_Session)):
+    """Consistency check of the cached due queue against the database (a drifted queue is reloaded)"""
+    return due_queues.check(session, user_id)
+
+@router.get("/due/stats")
+def get_due_queue_stats():
+    return due_queues.stats()
 
 @router.post("/review")
 def review_card(submission: ReviewSubmission, session: Session = Depends(get_Session)):
@@ -64,6 +83,11 @@ def review_card(submission: ReviewSubmission, session: Session = Depends(get_Ses
         review_date=datetime.now(timezone.utc)
     )
     session.add(log)
+    deck = card.deck
+    version = versions.bump_deck(session, deck.id, deck.user_id) if deck else None
     session.commit()
+
+    if deck and deck.status == DeckStatus.ACTIVE:
+        due_queues.card_reviewed(deck.user_id, deck.id, card.id, card.next_review_date, version)
     
     return {"status": "success", "next_review": card.next_review_date}
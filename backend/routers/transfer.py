@@ -0,0 +1,75 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session
+from typing import Literal
+import io
+import tempfile
+
+from database import engine
+from models import User
+from services.transfer import export_ndjson, export_cards_csv, export_reviews_csv, export_anki, import_ndjson, import_cards_csv
+
+router = APIRouter(prefix="/transfer", tags=["transfer"])
+
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv", "anki": "text/tab-separated-values"}
+EXTENSIONS = {"ndjson": "ndjson", "csv": "csv", "anki": "txt"}
+
+def stream(export, *args):
+    # own session - the request's one is closed before the body is streamed
+    with Session(engine) as session:
+        yield from export(session, *args)
+
+def download(chunks, format: str, name: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{name}.{EXTENSIONS[format]}"'}
+    )
+
+@router.get("/export")
+def export_collection(user_id: int, format: Literal["ndjson", "csv", "anki"] = "ndjson", include_reviews: bool = True):
+    """Streams all saved/archived decks of the user - ndjson (decks, cards, review logs), csv (cards) or anki (text import)"""
+    if format == "ndjson":
+        chunks = stream(export_ndjson, user_id, include_reviews)
+    elif format == "csv":
+        chunks = stream(export_cards_csv, user_id)
+    else:
+        chunks = stream(export_anki, user_id)
+    return download(chunks, format, f"wikicard_{user_id}")
+
+@router.get("/export/reviews")
+def export_reviews(user_id: int):
+    """Review history of the user as CSV"""
+    return download(stream(export_reviews_csv, user_id), "csv", f"wikicard_{user_id}_reviews")
+
+def run_import(file, user_id: int, format: str) -> dict:
+    lines = io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        with Session(engine) as session:
+            if format == "ndjson":
+                return import_ndjson(session, user_id, lines)
+            return import_cards_csv(session, user_id, lines)
+    finally:
+        lines.detach()
+
+@router.post("/import")
+async def import_collection(user_id: int, request: Request, format: Literal["ndjson", "csv"] = "ndjson"):
+    """Bulk import of an export file (raw request body), the cards are rescheduled from their last review"""
+    with Session(engine) as session:
+        if not session.get(User, user_id):
+            raise HTTPException(status_code=404, detail="User not found")
+
+    # the body goes to a temp file first, it's parsed line by line in the threadpool
+    with tempfile.TemporaryFile() as file:
+        async for chunk in request.stream():
+            file.write(chunk)
+        file.seek(0)
+
+        # every committed batch bumps the user version, the ETags and the cached due queue go stale with it
+        try:
+            result = await run_in_threadpool(run_import, file, user_id, format)
+        except (ValueError, KeyError, TypeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {format} file: {e}")
+
+    return result
@@ -0,0 +1,60 @@
+from typing import List, Any, Sequence
+import numpy as np
+
+# rough estimate for llama-style tokenizers on English prose, we don't ship a tokenizer
+# (Polish, code, numbers and names take fewer chars per token, so the estimate runs low there)
+CHARS_PER_TOKEN = 4
+# share of the context window kept free because the estimate above can undercount
+TOKEN_ESTIMATE_MARGIN = 0.15
+
+
+def estimate_tokens(text : str) -> int:
+    """Cheap token count estimate (no tokenizer call)"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _normalize(vectors : np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_order(relevance : Sequence[float], embeddings : Sequence[Sequence[float]], lambda_mult : float = 0.6) -> List[int]:
+    """Maximal marginal relevance ordering of the candidates
+        relevance - similarity of every candidate to the query (higher is better)
+        embeddings - already stored vectors of the candidates, used only for the diversity term
+    """
+    if len(relevance) == 0:
+        return []
+
+    relevance = np.asarray(relevance, dtype=float)
+    vectors = _normalize(np.asarray(embeddings, dtype=float))
+    similarity = vectors @ vectors.T
+
+    selected = [int(np.argmax(relevance))]
+    remaining = [i for i in range(len(relevance)) if i != selected[0]]
+
+    while remaining:
+        redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = remaining[int(np.argmax(scores))]
+        selected.append(best)
+        remaining.remove(best)
+
+    return selected
+
+
+def pack_context(docs : List[Any], order : List[int], token_budget : int) -> List[Any]:
+    """Greedily packs documents (in the given order) until the token budget is used up.
+        Passages that do not fit are skipped, smaller ones later in the order can still fill the gap.
+    """
+    packed = []
+    used = 0
+    for i in order:
+        cost = estimate_tokens(docs[i].page_content)
+        if used + cost > token_budget:
+            continue
+        packed.append(docs[i])
+        used += cost
+
+    return packed
@@ -0,0 +1,225 @@
+"""In-memory due-card queues of the study endpoints
+
+Per user a min-heap of (next review timestamp, card id) over the cards of the active decks, loaded lazily from SQLite
+on the first study request and then kept up to date by review/save/discard/delete instead of re-running the join.
+Every queue remembers the user version (services/versions.py) it is at. Writes of other processes bump that version
+in the database, so a queue whose version doesn't match anymore is reloaded on the next request.
+"""
+from typing import List, Dict, Set, Tuple, Optional, Any
+from collections import OrderedDict
+from datetime import datetime, timezone
+import heapq
+import threading
+
+from sqlmodel import Session, select
+
+import settings
+from models import Deck, DeckStatus, Flashcard
+from services.versions import versions
+
+
+def _timestamp(value : Optional[datetime]) -> float:
+    if value is None:
+        return 0.0 # no date = due right away
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc) # sqlite gives naive datetimes back
+    return value.timestamp()
+
+
+class UserDueQueue:
+    """Min-heap with lazy deletion - a heap entry is valid only while it matches due_at of its card"""
+    def __init__(self, version : int = 0):
+        self.version = version # user version of the data the queue reflects
+        self._heap : List[Tuple[float, int]] = []
+        self.due_at : Dict[int, float] = {} # card id -> next review timestamp
+        self.deck_cards : Dict[int, Set[int]] = {} # deck id -> card ids
+
+    def __len__(self) -> int:
+        return len(self.due_at)
+
+    def upsert(self, deck_id : int, card_id : int, due_at : float):
+        self.due_at[card_id] = due_at
+        self.deck_cards.setdefault(deck_id, set()).add(card_id)
+        heapq.heappush(self._heap, (due_at, card_id))
+        self._compact()
+
+    def remove_deck(self, deck_id : int):
+        for card_id in self.deck_cards.pop(deck_id, ()):
+            self.due_at.pop(card_id, None)
+        self._compact()
+
+    def _valid(self, entry : Tuple[float, int]) -> bool:
+        return self.due_at.get(entry[1]) == entry[0]
+
+    def _compact(self):
+        # rebuild once stale entries outnumber the live ones, keeps the heap O(n)
+        if len(self._heap) > 2 * len(self.due_at) + 64:
+            self._heap = [(due_at, card_id) for card_id, due_at in self.due_at.items()]
+            heapq.heapify(self._heap)
+
+    def _drop_stale_top(self):
+        while self._heap and not self._valid(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        self._drop_stale_top()
+        return self._heap[0][0] if self._heap else None
+
+    def due(self, now : float, limit : Optional[int] = None) -> List[int]:
+        """Card ids due at now, most overdue first - O(k log n) for k due cards"""
+        popped = []
+        while self._heap and (limit is None or len(popped) < limit):
+            self._drop_stale_top()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            popped.append(heapq.heappop(self._heap))
+
+        for entry in popped:
+            heapq.heappush(self._heap, entry)
+        return [card_id for _, card_id in popped]
+
+
+class DueQueueCache:
+    """Due queues of the most recently active users (LRU above max_users)"""
+    def __init__(self, max_users : int = 1000):
+        self.max_users = max_users
+        self._queues : "OrderedDict[int, UserDueQueue]" = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _load(session : Session, user_id : int, version : int) -> UserDueQueue:
+        # the version is read before the cards, the queue is never older than its version
+        queue = UserDueQueue(version)
+        rows = session.exec(
+            select(Flashcard.id, Flashcard.deck_id, Flashcard.next_review_date)
+            .join(Deck)
+            .where(Deck.user_id == user_id, Deck.status == DeckStatus.ACTIVE)
+        ).all()
+        for card_id, deck_id, next_review_date in rows:
+            queue.upsert(deck_id, card_id, _timestamp(next_review_date))
+        return queue
+
+    def _store(self, user_id : int, queue : UserDueQueue) -> UserDueQueue:
+        """Swaps a freshly loaded queue in, unless another request already stored a newer one (caller holds the lock)"""
+        current = self._queues.get(user_id)
+        if current is not None and current.version >= queue.version:
+            return current
+
+        self._queues[user_id] = queue
+        self._queues.move_to_end(user_id)
+        if len(self._queues) > self.max_users:
+            self._queues.popitem(last=False)
+            self.evictions += 1
+        return queue
+
+    def get(self, session : Session, user_id : int) -> UserDueQueue:
+        version = versions.user_version(session, user_id)
+        with self._lock:
+            queue = self._queues.get(user_id)
+            if queue is not None and queue.version == version:
+                self._queues.move_to_end(user_id)
+                self.hits += 1
+                return queue
+
+        # missing or stale (written by another process) - the join runs without the lock, the other users aren't blocked
+        queue = self._load(session, user_id, version)
+        with self._lock:
+            self.loads += 1
+            return self._store(user_id, queue)
+
+    def due_cards(self, session : Session, user_id : int, now : Optional[datetime] = None, limit : Optional[int] = None) -> List[int]:
+        queue = self.get(session, user_id)
+        with self._lock:
+            return queue.due(_timestamp(now or datetime.now(timezone.utc)), limit)
+
+    def summary(self, session : Session, user_id : int, now : Optional[datetime] = None) -> Dict[str, Any]:
+        queue = self.get(session, user_id)
+        with self._lock:
+            next_due = queue.next_due()
+            return {
+                "due": len(queue.due(_timestamp(now or datetime.now(timezone.utc)))),
+                "total": len(queue),
+                "next_due_at": datetime.fromtimestamp(next_due, timezone.utc) if next_due is not None else None
+            }
+
+    # updates - only touch users that are already loaded, the others are read fresh on their next request
+    # version is the user version the write bumped to, a queue can only apply it if it's exactly one behind
+
+    def _updatable(self, user_id : int, version : int) -> Optional[UserDueQueue]:
+        # caller holds the lock
+        queue = self._queues.get(user_id)
+        if queue is None or queue.version >= version:
+            return None # not loaded, or loaded after the write (already contains it)
+        if queue.version != version - 1:
+            self._queues.pop(user_id) # missed a write of another process / request, reload on the next request
+            return None
+        queue.version = version
+        return queue
+
+    def card_reviewed(self, user_id : int, deck_id : int, card_id : int, next_review_date : datetime, version : int):
+        with self._lock:
+            queue = self._updatable(user_id, version)
+            if queue is not None and deck_id in queue.deck_cards:
+                queue.upsert(deck_id, card_id, _timestamp(next_review_date))
+
+    def deck_activated(self, user_id : int, deck : Deck, version : int):
+        """Deck was saved (or got new cards) - (re)adds all of its cards"""
+        cards = [(card.id, _timestamp(card.next_review_date)) for card in deck.flashcards] # lazy load, not under the lock
+        with self._lock:
+            queue = self._updatable(user_id, version)
+            if queue is not None:
+                queue.remove_deck(deck.id)
+                for card_id, due_at in cards:
+                    queue.upsert(deck.id, card_id, due_at)
+
+    def deck_removed(self, user_id : int, deck_id : int, version : int):
+        """Deck was discarded or deleted"""
+        with self._lock:
+            queue = self._updatable(user_id, version)
+            if queue is not None:
+                queue.remove_deck(deck_id)
+
+    def invalidate(self, user_id : Optional[int] = None):
+        """Drops the queue of one user (or of everybody), it is reloaded on the next request"""
+        with self._lock:
+            if user_id is None:
+                self._queues.clear()
+            else:
+                self._queues.pop(user_id, None)
+
+    def check(self, session : Session, user_id : int) -> Dict[str, Any]:
+        """Compares the cached queue with the database, a queue that drifted is replaced by the fresh one"""
+        fresh = self._load(session, user_id, versions.user_version(session, user_id))
+        with self._lock:
+            cached = self._queues.get(user_id)
+
+            if cached is None:
+                return {"loaded": False, "consistent": True, "cards": len(fresh)}
+
+            missing = fresh.due_at.keys() - cached.due_at.keys()
+            extra = cached.due_at.keys() - fresh.due_at.keys()
+            mismatched = [card_id for card_id in fresh.due_at.keys() & cached.due_at.keys() if abs(fresh.due_at[card_id] - cached.due_at[card_id]) > 1e-3]
+
+            consistent = not (missing or extra or mismatched)
+            if not consistent:
+                self._queues[user_id] = fresh
+
+            return {
+                "loaded": True,
+                "consistent": consistent,
+                "cards": len(fresh),
+                "missing": len(missing),
+                "extra": len(extra),
+                "mismatched": len(mismatched)
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"users": len(self._queues), "max_users": self.max_users, "loads": self.loads, "hits": self.hits, "evictions": self.evictions}
+
+
+due_queues = DueQueueCache(max_users=settings.DUE_CACHE_MAX_USERS)
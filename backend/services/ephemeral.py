@@ -0,0 +1,56 @@
+from typing import List, Any, Tuple
+import numpy as np
+
+
+class NumpyIndex:
+    """Brute-force cosine index kept in memory
+        For a single article (tens/hundreds of chunks) a matrix product is faster than any vector db,
+        and nothing touches the disk
+    """
+    def __init__(self, embedding_function : Any):
+        self.embedding_function = embedding_function
+        self.docs = []
+        self.embeddings = None
+
+    @classmethod
+    def from_documents(cls, documents : List[Any], embedding : Any) -> "NumpyIndex":
+        index = cls(embedding)
+        index.add_documents(documents)
+        return index
+
+    def add_documents(self, documents : List[Any]):
+        if not documents:
+            return
+
+        vectors = np.asarray(self.embedding_function.embed_documents([doc.page_content for doc in documents]), dtype=float)
+        self.docs.extend(documents)
+        self.embeddings = vectors if self.embeddings is None else np.vstack([self.embeddings, vectors])
+
+    def count(self) -> int:
+        return len(self.docs)
+
+    def query(self, query_embedding : List[float], n_results : int) -> Tuple[List[str], List[Any], np.ndarray]:
+        """Top n_results documents by cosine similarity, returned as (ids, documents, stored vectors)"""
+        if not self.docs:
+            return [], [], np.empty((0, 0))
+
+        query_vector = np.asarray(query_embedding, dtype=float)
+        scores = self.embeddings @ query_vector / (np.linalg.norm(self.embeddings, axis=1) * np.linalg.norm(query_vector) + 1e-12)
+
+        n_results = min(n_results, len(self.docs))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+
+        return [str(i) for i in top], [self.docs[i] for i in top], self.embeddings[top]
+
+    def get(self, ids : List[str]) -> Tuple[List[Any], np.ndarray]:
+        positions = [int(i) for i in ids]
+        return [self.docs[i] for i in positions], self.embeddings[positions]
+
+    def all_documents(self) -> Tuple[List[str], List[str]]:
+        """(ids, texts) of everything in the index"""
+        return [str(i) for i in range(len(self.docs))], [doc.page_content for doc in self.docs]
+
+    def delete_collection(self):
+        self.docs = []
+        self.embeddings = None
@@ -0,0 +1,150 @@
+from typing import List, Dict, Any
+from datetime import datetime, timezone
+from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
+import hashlib
+
+from models import Deck, Flashcard, ArticleIndex, DeckArticleLink
+from services.versions import versions
+
+
+def build_rag_service() -> Any:
+    """RAGService configured from settings - the same for the API process, the generation workers and ingest.py
+        (imports the RAG stack, so only call it when a generation actually happens)
+    """
+    import settings
+    from services.rag import RAGService
+    from services.llm_cache import LLMResponseCache
+
+    return RAGService(
+        persist_directory=settings.CHROMA_DIRECTORY,
+        model_name=settings.MODEL_NAME,
+        cache=LLMResponseCache(settings.LLM_CACHE_PATH),
+        keep_alive=settings.MODEL_KEEP_ALIVE
+    )
+
+
+def get_or_create_article(session : Session, url : str, title : str) -> ArticleIndex:
+    article = session.exec(select(ArticleIndex).where(ArticleIndex.url == url)).first()
+    if article:
+        # a reused article counts as used, the GC only purges unlinked articles not touched for a while
+        article.updated_at = datetime.now(timezone.utc)
+        session.add(article)
+        session.commit()
+        session.refresh(article)
+        return article
+
+    article = ArticleIndex(url=url, title=title, collection_name=f"article_{hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]}")
+    session.add(article)
+    try:
+        session.commit()
+    except IntegrityError:
+        # another generation of the same url created it in the meantime
+        session.rollback()
+        return session.exec(select(ArticleIndex).where(ArticleIndex.url == url)).one()
+
+    session.refresh(article)
+    return article
+
+
+def run_generation(session : Session, rag_service : Any, deck : Deck, params : Dict[str, Any]) -> List[Flashcard]:
+    """Whole pipeline for one draft deck: scrape -> chunk -> index -> generate -> save the cards
+        Runs in the API process or in a generation worker, params are the fields of GenerateRequest
+    """
+    docs = rag_service.scrape_and_load(params["url"])
+    wiki_title = docs[0].metadata.get('title', 'Wikipedia Page').strip()
+
+    chunks = rag_service.chunk_documents(docs)
+
+    collection_name = f"deck_{deck.id}"
+    if params["index_mode"] == "persistent":
+        # persistent article index, later generations/refreshes only embed what changed
+        article = get_or_create_article(session, params["url"], wiki_title)
+        # link the draft right away so the GC keeps the article however long the generation takes
+        # (the link goes away with the draft if the generation fails)
+        session.add(DeckArticleLink(deck_id=deck.id, article_id=article.id))
+        session.commit()
+        revision_id = rag_service.fetch_revision_id(params["url"])
+        collection_name = article.collection_name
+
+    # index + generate
+    generated_cards = rag_service.generate_deck_cards(
+        chunks,
+        title=wiki_title,
+        collection_name=collection_name,
+        deck_size=params["deck_size"],
+        latency_budget=params["latency_budget"],
+        fresh=params["fresh"],
+        index_mode=params["index_mode"],
+        retrieval_mode=params["retrieval_mode"]
+    )
+
+    if params["index_mode"] == "persistent":
+        article.revision_id = revision_id
+        article.updated_at = datetime.now(timezone.utc)
+        session.add(article)
+
+    # save our flashcard to db
+    created_cards = []
+    for card in generated_cards:
+        flashcard = Flashcard(
+            front=card.get("front", "Error"),
+            back=card.get("back", "Error"),
+            deck_id=deck.id,
+
+            # SM-2 default vals
+            easiness_factor=2.5,
+            interval=0,
+            repetitions=0
+        )
+        session.add(flashcard)
+        created_cards.append(flashcard)
+
+    versions.bump_deck(session, deck.id, deck.user_id)
+    session.commit()
+    return created_cards
+
+
+def run_refresh(session : Session, rag_service : Any, deck : Deck, regenerate : bool = False, num_cards : int = 5) -> Dict[str, Any]:
+    """Re-indexes the source article of the deck if it has a new revision
+        Only added/changed chunks are embedded, with regenerate=True up to num_cards new cards are created from them
+        Runs in the API process or in a generation worker, returns a JSON-able summary
+    """
+    link = session.get(DeckArticleLink, deck.id)
+    if not link:
+        raise ValueError("Deck has no indexed source article")
+    article = session.get(ArticleIndex, link.article_id)
+
+    revision_id = rag_service.fetch_revision_id(article.url)
+    if revision_id is not None and revision_id == article.revision_id:
+        return {"status": "up_to_date", "revision_id": revision_id, "added": 0, "removed": 0, "unchanged": None, "new_cards": 0}
+
+    docs = rag_service.scrape_and_load(article.url)
+    chunks = rag_service.chunk_documents(docs)
+    diff = rag_service.sync_index(chunks, article.collection_name)
+
+    new_cards = []
+    if regenerate and diff["added"]:
+        num_cards = min(num_cards, len(diff["added"]))
+        generated = rag_service.generate_from_chunks(diff["added"], topic=f"Create {num_cards} flashcards about {article.title}", num_cards=num_cards)
+        for card in generated:
+            flashcard = Flashcard(front=card["front"], back=card["back"], deck_id=deck.id)
+            session.add(flashcard)
+            new_cards.append(flashcard)
+
+    article.revision_id = revision_id
+    article.updated_at = datetime.now(timezone.utc)
+    session.add(article)
+    if new_cards:
+        # the cached due queues of the owner go stale with the version (reloaded on the next study request)
+        versions.bump_deck(session, deck.id, deck.user_id)
+    session.commit()
+
+    return {
+        "status": "refreshed",
+        "revision_id": revision_id,
+        "added": len(diff["added"]),
+        "removed": diff["removed"],
+        "unchanged": diff["unchanged"],
+        "new_cards": len(new_cards)
+    }
@@ -0,0 +1,63 @@
+from typing import List, Dict, Tuple, Any, Sequence
+from collections import Counter, defaultdict
+import math
+import re
+
+_TOKEN = re.compile(r"\w\w+", re.UNICODE)
+
+
+def tokenize(text : str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """In-process BM25 inverted index over the chunks of one collection
+        ids - ids of the documents in the vector store, so both rankings can be fused
+    """
+    def __init__(self, ids : Sequence[str], texts : Sequence[str], k1 : float = 1.5, b : float = 0.75):
+        self.ids = list(ids)
+        self.k1 = k1
+        self.b = b
+
+        self.postings : Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_lengths = []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings[term].append((i, tf))
+
+        n = len(self.doc_lengths)
+        self.avg_length = sum(self.doc_lengths) / n if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query : str, k : int) -> List[Tuple[str, float]]:
+        """Top k (id, score) pairs, documents without any query term are skipped"""
+        scores : Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+
+            for i, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / (self.avg_length or 1.0))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[i], score) for i, score in top]
+
+
+def reciprocal_rank_fusion(rankings : Sequence[Sequence[Any]], k : int = 60) -> List[Tuple[Any, float]]:
+    """Fuses several rankings (lists of ids, best first) into one, score = sum of 1 / (k + rank)"""
+    scores : Dict[Any, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1.0 / (k + rank + 1)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,75 @@
+from typing import Dict, Any, Optional
+from datetime import datetime, timezone
+import asyncio
+import time
+
+
+class ModelWarmer:
+    """Keeps the ollama chat and embedding models loaded
+        warm_up() loads both concurrently, run() repeats it every heartbeat_seconds so ollama doesn't unload them
+    """
+    def __init__(self, model_name : str, keep_alive : int, embedding_model : Optional[str] = None):
+        self.model_name = model_name
+        self.embedding_model = embedding_model or model_name
+        self.keep_alive = keep_alive
+
+        self.state : Dict[str, Dict[str, Any]] = {
+            "chat": {"model": self.model_name, "status": "cold", "warm_up_latency": None, "heartbeat_latency": None, "last_heartbeat": None, "error": None},
+            "embeddings": {"model": self.embedding_model, "status": "cold", "warm_up_latency": None, "heartbeat_latency": None, "last_heartbeat": None, "error": None}
+        }
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            import ollama # OLLAMA_HOST is read from the environment
+            self._client = ollama.Client()
+        return self._client
+
+    def _load_chat(self):
+        # an empty prompt only loads the model into memory
+        self.client.generate(model=self.model_name, prompt="", keep_alive=self.keep_alive)
+
+    def _load_embeddings(self):
+        self.client.embed(model=self.embedding_model, input="warm up", keep_alive=self.keep_alive)
+
+    async def _warm(self, name : str, load):
+        state = self.state[name]
+        heartbeat = state["status"] == "warm" # only the (re)load of a cold model counts as warm-up latency
+        if not heartbeat:
+            state["status"] = "loading"
+
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(load)
+        except Exception as e:
+            state.update(status="error", error=str(e))
+            print(f"Could not warm up the {name} model: {e}")
+            return
+
+        latency = round(time.perf_counter() - started, 3)
+        state.update(status="warm", last_heartbeat=datetime.now(timezone.utc).isoformat(), error=None)
+        state["heartbeat_latency" if heartbeat else "warm_up_latency"] = latency
+
+    async def warm_up(self):
+        await asyncio.gather(
+            self._warm("chat", self._load_chat),
+            self._warm("embeddings", self._load_embeddings)
+        )
+
+    async def run(self, heartbeat_seconds : int):
+        """Warm up, then keep the models resident until cancelled"""
+        await self.warm_up()
+        if heartbeat_seconds <= 0:
+            return
+
+        while True:
+            await asyncio.sleep(heartbeat_seconds)
+            await self.warm_up()
+
+    @property
+    def ready(self) -> bool:
+        return all(state["status"] == "warm" for state in self.state.values())
+
+    def report(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "keep_alive": self.keep_alive, "models": self.state}
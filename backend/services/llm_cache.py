@@ -0,0 +1,114 @@
+from typing import Optional, Dict, Any
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class LLMResponseCache:
+    """Persistent cache of LLM responses (SQLite file next to our database)
+        Entries expire after ttl_seconds, above max_entries the least recently used ones are evicted
+        The file also keeps the hit/miss and generation counters, so they add up over all worker processes
+    """
+    def __init__(self, path : str = "llm_cache.db", ttl_seconds : float = 7 * 24 * 3600, max_entries : int = 5000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL") # the API process and the workers share the file
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_access ON llm_cache (last_access)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def _incr(self, name : str, value : int):
+        # caller holds the lock and commits
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+            (name, value)
+        )
+
+    def incr_counter(self, name : str, value : int = 1):
+        with self._lock:
+            self._incr(name, value)
+            self._conn.commit()
+
+    def counters(self, prefix : str = "") -> Dict[str, int]:
+        """Counters starting with prefix (without it), summed over every process using the file"""
+        with self._lock:
+            rows = self._conn.execute("SELECT name, value FROM counters WHERE name LIKE ?", (prefix + "%",)).fetchall()
+        return {name[len(prefix):]: value for name, value in rows}
+
+    @staticmethod
+    def make_key(model_name : str, rendered_prompt : str, params : Dict[str, Any]) -> str:
+        """Key = model + hash of the rendered prompt (with the retrieved context) + generation parameters"""
+        payload = json.dumps({"model": model_name, "prompt": hashlib.sha256(rendered_prompt.encode("utf-8")).hexdigest(), "params": params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key : str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._incr("cache.misses", 1)
+                self._conn.commit()
+                return None
+
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._incr("cache.hits", 1)
+            self._conn.commit()
+            return json.loads(row[0])
+
+    def set(self, key : str, value : Any):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+
+            # LRU eviction
+            self._conn.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> int:
+        """Removes expired entries, returns how many were removed"""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+        counts = self.counters("cache.")
+        hits, misses = counts.get("hits", 0), counts.get("misses", 0)
+        return {
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+        }
+
+    def vacuum(self):
+        """Gives the space of evicted/expired entries back to the filesystem"""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
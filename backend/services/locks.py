@@ -0,0 +1,18 @@
+"""Inter-process file locks (API processes, generation workers and ingest.py share the same files)"""
+import os
+
+from filelock import FileLock
+
+
+def index_write_lock(persist_directory : str) -> FileLock:
+    """Serializes writes to the persistent chroma directory
+        Chroma doesn't support several processes writing one PersistentClient directory, with many workers
+        (or several API processes) a Chroma server is the better option
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    return FileLock(os.path.join(persist_directory, ".write.lock"))
+
+
+def process_lock(path : str) -> FileLock:
+    """Lock held by a process (not a thread) - only one of the processes runs what it guards"""
+    return FileLock(path, thread_local=False)
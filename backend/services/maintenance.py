@@ -0,0 +1,286 @@
+"""Periodic garbage collection of the database and the vector store
+
+- draft decks nobody saved and archived decks past their retention are deleted (cards and review logs cascade)
+- finished generation jobs and expired LLM cache entries are purged
+- chroma collections without a deck/article behind them are dropped
+- SQLite space is given back with an incremental VACUUM, the query planner stats are refreshed with ANALYZE
+
+With several API processes only one of them runs the periodic GC (the one holding the leader lock next to the database),
+a second lock held only while collecting keeps manual runs of the other processes from overlapping with it.
+"""
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime, timezone, timedelta
+import asyncio
+import os
+import threading
+import time
+
+from filelock import Timeout
+from sqlalchemy import func, delete, or_, text
+from sqlmodel import Session, select
+
+import settings
+from database import engine
+from models import Deck, DeckStatus, Flashcard, ReviewLog, ArticleIndex, DeckArticleLink, GenerationJob, JobStatus
+from services.versions import versions
+from services.locks import index_write_lock, process_lock
+
+DELETE_BATCH_SIZE = 500 # keeps single write transactions short, the study endpoints share the db
+
+
+def _directory_size(path : str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _delete_decks(session : Session, decks : List[Tuple[int, int]]) -> int:
+    """Bulk delete of (deck id, user id) rows, flashcards/review logs/article links go with the ON DELETE CASCADE foreign keys"""
+    for start in range(0, len(decks), DELETE_BATCH_SIZE):
+        batch = decks[start:start + DELETE_BATCH_SIZE]
+        session.exec(delete(Deck).where(Deck.id.in_([deck_id for deck_id, _ in batch])))
+        # cached deck cards / deck lists of the deleted decks must not get a 304
+        for deck_id, user_id in batch:
+            versions.bump_deck(session, deck_id, user_id)
+        session.commit()
+    return len(decks)
+
+
+def purge_stale_decks(session : Session, draft_ttl : timedelta, archive_retention : timedelta) -> Dict[str, int]:
+    """Drafts older than draft_ttl (and not being generated right now) and archived decks
+        without any activity (creation or last review) for archive_retention
+    """
+    now = datetime.now(timezone.utc)
+
+    pending_decks = select(GenerationJob.deck_id).where(
+        GenerationJob.status.in_([JobStatus.QUEUED, JobStatus.RUNNING]),
+        GenerationJob.deck_id.is_not(None)
+    )
+    drafts = session.exec(
+        select(Deck.id, Deck.user_id)
+        .where(Deck.status == DeckStatus.DRAFT, Deck.created_at < now - draft_ttl)
+        .where(Deck.id.not_in(pending_decks))
+    ).all()
+
+    last_review = (
+        select(Flashcard.deck_id, func.max(ReviewLog.review_date).label("reviewed_at"))
+        .join(ReviewLog, ReviewLog.flashcard_id == Flashcard.id)
+        .group_by(Flashcard.deck_id)
+        .subquery()
+    )
+    archived = session.exec(
+        select(Deck.id, Deck.user_id)
+        .outerjoin(last_review, last_review.c.deck_id == Deck.id)
+        .where(Deck.status == DeckStatus.ARCHIVED, Deck.created_at < now - archive_retention)
+        .where(or_(last_review.c.reviewed_at.is_(None), last_review.c.reviewed_at < now - archive_retention))
+    ).all()
+
+    return {
+        "drafts": _delete_decks(session, [tuple(row) for row in drafts]),
+        "archived": _delete_decks(session, [tuple(row) for row in archived])
+    }
+
+
+def purge_finished_jobs(session : Session, retention : timedelta) -> int:
+    cutoff = datetime.now(timezone.utc) - retention
+    result = session.exec(
+        delete(GenerationJob)
+        .where(GenerationJob.status.in_([JobStatus.DONE, JobStatus.FAILED]))
+        .where(GenerationJob.finished_at < cutoff)
+    )
+    session.commit()
+    return result.rowcount
+
+
+def purge_unused_articles(session : Session, retention : timedelta) -> List[str]:
+    """Article indexes no deck links to anymore, returns their (now orphaned) collection names"""
+    cutoff = datetime.now(timezone.utc) - retention
+    articles = session.exec(
+        select(ArticleIndex)
+        .where(ArticleIndex.updated_at < cutoff)
+        .where(ArticleIndex.id.not_in(select(DeckArticleLink.article_id)))
+    ).all()
+
+    names = [article.collection_name for article in articles]
+    for article in articles:
+        session.delete(article)
+    session.commit()
+    return names
+
+
+def purge_orphaned_collections(session : Session, persist_directory : str) -> List[str]:
+    """Drops deck_<id> collections of decks that are gone or finished generating and article_* collections without an ArticleIndex"""
+    if not os.path.isdir(persist_directory):
+        return []
+
+    import chromadb # only here, the API process doesn't import the vector store otherwise
+
+    client = chromadb.PersistentClient(path=persist_directory)
+    names = [getattr(collection, "name", collection) for collection in client.list_collections()] # names only in chroma >= 0.6
+
+    drafts = set(session.exec(select(Deck.id).where(Deck.status == DeckStatus.DRAFT)).all())
+    articles = set(session.exec(select(ArticleIndex.collection_name)).all())
+
+    orphaned = []
+    for name in names:
+        if name.startswith("deck_"):
+            deck_id = name[len("deck_"):]
+            # a draft can still be generating, anything else doesn't need its collection anymore
+            if not deck_id.isdigit() or int(deck_id) not in drafts:
+                orphaned.append(name)
+        elif name.startswith("article_") and name not in articles:
+            orphaned.append(name)
+
+    with index_write_lock(persist_directory):
+        for name in orphaned:
+            try:
+                client.delete_collection(name)
+            except Exception as e:
+                print(f"Failed to delete the orphaned collection {name}: {e}")
+    return orphaned
+
+
+def vacuum_database(pages : int = 0) -> Dict[str, Any]:
+    """Gives free pages back to the filesystem and refreshes the planner stats
+        The first run converts the db to auto_vacuum=INCREMENTAL (one full VACUUM), later runs only free up to pages pages (0 = all)
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        page_size = connection.execute(text("PRAGMA page_size")).scalar()
+        free_before = connection.execute(text("PRAGMA freelist_count")).scalar()
+
+        if connection.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            connection.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            connection.execute(text("VACUUM"))
+            mode = "full"
+        else:
+            connection.execute(text(f"PRAGMA incremental_vacuum({int(pages)})" if pages else "PRAGMA incremental_vacuum"))
+            mode = "incremental"
+
+        connection.execute(text("ANALYZE"))
+        connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        free_after = connection.execute(text("PRAGMA freelist_count")).scalar()
+
+    return {"mode": mode, "freed_pages": max(free_before - free_after, 0), "free_pages_left": free_after, "page_size": page_size}
+
+
+class Maintenance:
+    """Runs the whole garbage collection, periodically from the lifespan or on demand from /maintenance/run"""
+    def __init__(self, draft_ttl_seconds : int, archive_retention_days : int, job_retention_days : int,
+                 persist_directory : Optional[str] = None, vacuum_pages : int = 0, llm_cache_path : Optional[str] = None,
+                 lock_path : Optional[str] = None):
+        self.draft_ttl = timedelta(seconds=draft_ttl_seconds)
+        self.archive_retention = timedelta(days=archive_retention_days)
+        self.job_retention = timedelta(days=job_retention_days)
+        self.persist_directory = persist_directory # None = don't touch the vector store
+        self.vacuum_pages = vacuum_pages
+        self.llm_cache_path = llm_cache_path
+
+        self.last_report : Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        # None = single process, no file locks
+        self._leader_lock = process_lock(f"{lock_path}.leader") if lock_path else None # held for the life of the periodic task
+        self._running_lock = process_lock(lock_path) if lock_path else None # held only while collecting
+        self._leader = False
+
+    def _disk_usage(self) -> Dict[str, int]:
+        db_path = engine.url.database
+        usage = {"database": sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path))}
+        if self.persist_directory:
+            usage["vector_store"] = _directory_size(self.persist_directory)
+        if self.llm_cache_path and os.path.exists(self.llm_cache_path):
+            usage["llm_cache"] = os.path.getsize(self.llm_cache_path)
+        return usage
+
+    def run_once(self) -> Dict[str, Any]:
+        """One blocking GC pass, returns what was removed and how many bytes were reclaimed
+            (or {"skipped": True} if another process is running the GC right now)
+        """
+        with self._lock:
+            if self._running_lock is not None:
+                try:
+                    self._running_lock.acquire(timeout=0)
+                except Timeout:
+                    return {"skipped": True, "reason": "The garbage collection is running in another process"}
+            try:
+                return self._run()
+            finally:
+                if self._running_lock is not None:
+                    self._running_lock.release()
+
+    def _run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        before = self._disk_usage()
+        report : Dict[str, Any] = {"started_at": datetime.now(timezone.utc).isoformat()}
+
+        with Session(engine) as session:
+            report["decks"] = purge_stale_decks(session, self.draft_ttl, self.archive_retention)
+            report["jobs"] = purge_finished_jobs(session, self.job_retention)
+
+            if self.persist_directory:
+                report["articles"] = len(purge_unused_articles(session, self.archive_retention))
+                try:
+                    report["collections"] = purge_orphaned_collections(session, self.persist_directory)
+                except Exception as e:
+                    print(f"Vector store cleanup failed: {e}")
+                    report["collections"] = []
+
+        if self.llm_cache_path:
+            from services.llm_cache import LLMResponseCache
+            cache = LLMResponseCache(self.llm_cache_path)
+            report["llm_cache_entries"] = cache.purge_expired()
+            cache.vacuum()
+            cache.close()
+
+        report["vacuum"] = vacuum_database(self.vacuum_pages)
+
+        after = self._disk_usage()
+        report["disk_bytes"] = after
+        report["reclaimed_bytes"] = {name: max(before[name] - after.get(name, 0), 0) for name in before}
+        report["duration"] = round(time.perf_counter() - started, 3)
+
+        self.last_report = report
+        return report
+
+    def _claim_leadership(self) -> bool:
+        """The first process to get the file lock keeps it and runs the periodic GC, the others retry every interval"""
+        if self._leader_lock is None or self._leader:
+            return True
+        try:
+            self._leader_lock.acquire(timeout=0)
+            self._leader = True
+        except Timeout:
+            pass
+        return self._leader
+
+    async def run(self, interval_seconds : int):
+        """GC every interval_seconds until cancelled (off the event loop, the deletes block)"""
+        try:
+            while True:
+                await asyncio.sleep(interval_seconds)
+                if not self._claim_leadership():
+                    continue
+                try:
+                    report = await asyncio.to_thread(self.run_once)
+                    print(f"Maintenance: {report['decks']}, reclaimed {report['reclaimed_bytes']} bytes")
+                except Exception as e:
+                    print(f"Maintenance run failed: {e}")
+        finally:
+            if self._leader:
+                self._leader_lock.release()
+                self._leader = False
+
+
+maintenance = Maintenance(
+    draft_ttl_seconds=settings.DRAFT_TTL_SECONDS,
+    archive_retention_days=settings.ARCHIVE_RETENTION_DAYS,
+    job_retention_days=settings.JOB_RETENTION_DAYS,
+    persist_directory=settings.CHROMA_DIRECTORY if settings.API_MODE != "study" else None, # study-only processes never import chromadb
+    vacuum_pages=settings.VACUUM_PAGES,
+    llm_cache_path=settings.LLM_CACHE_PATH,
+    lock_path=f"{engine.url.database}.maintenance.lock"
+)
@@ -5,25 +5,76 @@ from langchain_ollama import OllamaEmbeddings
 from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from typing import List, Dict, Any
-from pydantic import BaseModel, Field
+from langchain_core.documents import Document
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from collections import OrderedDict
+from urllib.parse import urlparse, unquote
+import numpy as np
+import requests
+import hashlib
+import math
+import threading
+import time
+import uuid
 import os
 
-class FlashcardSchema(BaseModel):
-    front : str = Field(description="This is the front of the flashcard (question)")
-    back : str = Field(description="This is the back of the flashcard (answer)")
+from services.context import TOKEN_ESTIMATE_MARGIN, estimate_tokens, mmr_order, pack_context
+from services.llm_cache import LLMResponseCache
+from services.ephemeral import NumpyIndex
+from services.lexical import BM25Index, reciprocal_rank_fusion
+from services.locks import index_write_lock
+from services.structured import FlashcardSchema, FlashcardDeckSchema, GenerationStats, repair_json, validate_cards
 
-class FlashcardDeckSchema(BaseModel):
-    cards : List[FlashcardSchema] = Field(description="This is our list of 5 flashcards")
+# decks up to this size come from a single prompt, bigger ones go through map-reduce generation
+SINGLE_PROMPT_DECK_SIZE = 5
+
+# persistent - article index in ./chroma_db, kept and synced incrementally
+# memory - in-memory chroma collection, numpy - brute-force cosine index (both thrown away after one generation)
+INDEX_MODES = ("persistent", "memory", "numpy")
+
+# hybrid - vector + BM25 fused with reciprocal rank fusion, lexical - BM25 only (no embedding call)
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+def format_docs(docs : List[Any]) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
 
 class RAGService:
-    def __init__(self, persist_directory : str = "./chroma_db", model_name : str = 'llama3.1'):
+    def __init__(self, persist_directory : str = "./chroma_db", model_name : str = 'llama3.1', context_window : int = 8192, max_output_tokens : int = 1024,
+                 cache : Optional[LLMResponseCache] = None, embed_timeout : float = 10.0, max_lexical_indexes : int = 64, keep_alive : Optional[int] = None,
+                 request_timeout : float = 120.0):
         self.model_name = model_name
         self.persist_directory = persist_directory
 
+        # token budget of a single generation, num_ctx is set explicitly so ollama doesn't silently truncate the prompt
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+
         # Initialize embedding and LLM
-        self.embedding_function = OllamaEmbeddings(model=self.model_name)
-        self.llm = ChatOllama(model=self.model_name, temperature=0.1)
+        # keep_alive - seconds ollama keeps the model loaded after a request (-1 forever, None server default)
+        self.embedding_function = OllamaEmbeddings(model=self.model_name, keep_alive=keep_alive)
+        # structured output - ollama constrains the answer to the JSON schema of our deck
+        self.llm = ChatOllama(
+            model=self.model_name,
+            keep_alive=keep_alive,
+            temperature=0.1,
+            num_ctx=self.context_window,
+            num_predict=self.max_output_tokens,
+            format=FlashcardDeckSchema.model_json_schema(),
+            client_kwargs={"timeout": request_timeout} # a hung ollama call must not outlive the request that waits for it
+        )
+        # same model + same rendered prompt (incl. retrieved context) + same params -> same (near-identical) answer
+        self.cache = cache if cache is not None else LLMResponseCache()
+        self.generation_stats = GenerationStats(self.cache) # counters live in the cache file, shared with the other processes
+
+        # BM25 indexes built next to the vector collections (LRU, persistent ones are rebuilt lazily after a restart)
+        self.max_lexical_indexes = max_lexical_indexes
+        self._lexical_indexes = OrderedDict()
+        self._lexical_lock = threading.Lock() # shared by concurrent requests and the map-reduce threads
+
+        # query embedding slower than embed_timeout (overloaded ollama) -> lexical-only retrieval
+        self.embed_timeout = embed_timeout
+        self._embed_executor = ThreadPoolExecutor(max_workers=2)
 
     def scrape_and_load(self, url : str) -> List[Any]:
         """Scrapes and loads the content of our Wikipedia page"""
@@ -50,126 +101,529 @@ class RAGService:
         splits = text_splitter.split_documents(docs)
         return splits
     
-    def index_documents(self, chunks : List[Any], collection_name : str) -> Chroma: # vectorization
-        """Vectorizes our chunks"""
-
-        vector_store = Chroma.from_documents(
-            documents=chunks,
-            embedding=self.embedding_function,
-            collection_name=collection_name,
-            persist_directory=self.persist_directory
-        )
+    def index_documents(self, chunks : List[Any], collection_name : str, mode : str = "persistent") -> Any: # vectorization
+        """Vectorizes our chunks, the BM25 index of the collection is built alongside"""
+        if mode == "numpy":
+            vector_store = NumpyIndex.from_documents(chunks, self.embedding_function)
+            self._set_lexical_index(collection_name, BM25Index(*vector_store.all_documents()))
+            return vector_store
 
-        return vector_store
+        ids = [str(uuid.uuid4()) for _ in chunks]
+        self._set_lexical_index(collection_name, BM25Index(ids, [chunk.page_content for chunk in chunks]))
 
-    def generate_flashcards(self, collection_name : str, topic : str = "Create 5 flashcards about this wikipedia page") -> List[Dict[str, str]]:
-            """Generates our flashcards utilizing RAG
-                Retrieves context from our vectordb and prompts the LLM
-            """
-            def format_docs(docs):
-                return "\n\n".join(doc.page_content for doc in docs)
+        if mode == "memory":
+            # no persist_directory -> in-memory chroma client, no disk writes
+            return Chroma.from_documents(
+                documents=chunks,
+                embedding=self.embedding_function,
+                collection_name=collection_name,
+                ids=ids
+            )
 
-            vector_store = Chroma(
+        vector_store = self._open_persistent(collection_name)
+        self._write_chunks(vector_store, chunks, ids)
+
+        return vector_store
+
+    def _open_persistent(self, collection_name : str) -> Chroma:
+        # opening creates the collection if it's missing, that's a write too
+        with index_write_lock(self.persist_directory):
+            return Chroma(
                 collection_name=collection_name,
                 embedding_function=self.embedding_function,
                 persist_directory=self.persist_directory
             )
 
-            retriever = vector_store.as_retriever(search_kwargs = {'k': 12}) # top 12 answers, the closest
-            context_docs = retriever.invoke(f"important facts, key definitions, concepts, summary about {topic}")
-            context_text = format_docs(context_docs)
+    def _write_chunks(self, vector_store : Chroma, chunks : List[Any], ids : List[str]):
+        """Embeds outside of the write lock (slow, ollama), only the chroma write is serialized between the processes"""
+        texts = [chunk.page_content for chunk in chunks]
+        embeddings = self.embedding_function.embed_documents(texts)
+        # chroma rejects empty metadata dicts
+        metadatas = [chunk.metadata for chunk in chunks] if all(chunk.metadata for chunk in chunks) else None
+        with index_write_lock(self.persist_directory):
+            vector_store._collection.upsert(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
 
-            parser = JsonOutputParser(pydantic_object=FlashcardDeckSchema)
-            
-            # template = """
-            #         ROLE:
-            #         You are an academic knowledge assistant. Your mission is to transform raw text (Wikipedia data) into high-quality pedagogical materials (flashcards).
-
-            #         TASK:
-            #         Analyze the provided context and generate flashcards optimized for spaced repetition based on the user's request. Everytime, try to generate different flashcards.
-
-            #         GOALS:
-            #         1. Extract core definitions, core information, and scientific concepts.
-            #         2. Focus on single, atomic facts for better memory retention.
-            #         3. Use precise, objective academic language.
-            #         4. Output strictly as a JSON object following the format instructions below.
-
-            #         CONTEXT (SOURCE MATERIAL):
-            #         {context}
-
-            #         RULES:
-            #         - Do NOT add information that is not present in the CONTEXT documents.
-            #         - IGNORE metadata like edit dates, licensing info, or source citations, etc.
-            #         - If facts are missing, do not invent information.
-            #         - NO conversational fillers (e.g., {{"Here are your flashcards"}} etc.). Output ONLY the JSON.
-
-            #         FORMAT INSTRUCTIONS:
-            #         {format_instructions}
-
-            #         USER REQUEST:
-            #         {topic}
-            #         """
-            # prompt = ChatPromptTemplate.from_template(template)
-
-            prompt = ChatPromptTemplate.from_messages([
-                (
-                    "system", """
-                    ROLE:
-                    You are an academic knowledge assistant. Your mission is to transform raw text (Wikipedia data) into high-quality pedagogical materials (flashcards).
-
-                    GOALS:
-                    1. Extract 5 most fundamental facts: core definitions, core information, and scientific concepts.
-                    2. Focus on single, atomic facts for better memory retention.
-                    3. Use the "Minimum Information Principle": each card must be brief and focus on ONE specific piece of information.
-                    4. Front should be a clear question, Back should be a concise answer.
-                    5. Use precise, objective academic language.
-                    6. Output strictly as a JSON object following the format instructions below.
-
-                    RULES:
-                    - Do NOT add information that is not present in the CONTEXT documents.
-                    - IGNORE metadata like edit dates, licensing info, or source citations, etc.
-                    - If facts are missing, do not invent information.
-                    - NO conversational fillers (e.g., {{"Here are your flashcards"}} etc.). Output ONLY the JSON.
-
-                    FORMAT INSTRUCTIONS:
-                    {format_instructions}
-                """),
-                ("user","""
-                    TASK:
-                    Analyze the provided context and generate flashcards optimized for spaced repetition based on the user's request. Everytime, try to generate different flashcards.
-                 
-                    CONTEXT (SOURCE MATERIAL):
-                    {context}
-
-                    USER REQUEST:
-                    {topic}
-                """)
-            ])
-
-            chain = prompt | self.llm | parser
+    def _set_lexical_index(self, collection_name : str, index : BM25Index):
+        with self._lexical_lock:
+            self._lexical_indexes[collection_name] = index
+            self._lexical_indexes.move_to_end(collection_name)
+            while len(self._lexical_indexes) > self.max_lexical_indexes:
+                self._lexical_indexes.popitem(last=False)
 
-            try:
-                response = chain.invoke({
-                    'context' : context_text,
-                    'topic' : topic,
-                    'format_instructions' : parser.get_format_instructions()
-                })
+    def _drop_lexical_index(self, collection_name : str):
+        with self._lexical_lock:
+            self._lexical_indexes.pop(collection_name, None)
+
+    def _lexical_index(self, collection_name : str, vector_store : Any) -> BM25Index:
+        """BM25 index of the collection, rebuilt from the stored documents if we don't have it in memory"""
+        with self._lexical_lock:
+            index = self._lexical_indexes.get(collection_name)
+        if index is None:
+            if isinstance(vector_store, NumpyIndex):
+                index = BM25Index(*vector_store.all_documents())
+            else:
+                result = vector_store._collection.get(include=["documents"])
+                index = BM25Index(result["ids"], result["documents"])
+
+        self._set_lexical_index(collection_name, index)
+        return index
+
+    @staticmethod
+    def chunk_hash(chunk : Any) -> str:
+        """Content hash of a chunk, used as its id in the persistent article index"""
+        return hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+
+    def fetch_revision_id(self, url : str) -> Optional[int]:
+        """Current revision id of the Wikipedia article (None if it could not be fetched)"""
+        parsed = urlparse(url)
+        title = unquote(parsed.path.split("/wiki/", 1)[-1])
 
-                return response.get('cards', [])
-            except Exception as e:
-                print(f'Error when generating flashcards : {e}')
-                return []
-            
-    def delete_collection(self, collection_name : str):
-        """Cleans up our vector_store collection"""
         try:
+            response = requests.get(
+                f"{parsed.scheme or 'https'}://{parsed.netloc}/w/api.php",
+                params={"action": "query", "prop": "revisions", "rvprop": "ids", "titles": title, "format": "json", "formatversion": 2},
+                headers={"User-Agent": os.environ.get("USER_AGENT", "WikiCardAI")},
+                timeout=10
+            )
+            response.raise_for_status()
+            return response.json()["query"]["pages"][0]["revisions"][0]["revid"]
+        except Exception as e:
+            print(f"Could not fetch the revision of {url}: {e}")
+            return None
+
+    def sync_index(self, chunks : List[Any], collection_name : str) -> Dict[str, Any]:
+        """Incrementally updates a persistent article index
+            Chunks are identified by their content hash - only added/changed chunks get embedded, removed ones are deleted
+            returns {"added": [new chunks], "removed": count, "unchanged": count}
+        """
+        vector_store = self._open_persistent(collection_name)
+
+        new_chunks = {}
+        for chunk in chunks:
+            new_chunks.setdefault(self.chunk_hash(chunk), chunk)
+
+        existing_ids = set(vector_store._collection.get(include=[])["ids"])
+        added_ids = [chunk_id for chunk_id in new_chunks if chunk_id not in existing_ids]
+        removed_ids = [chunk_id for chunk_id in existing_ids if chunk_id not in new_chunks]
+
+        if added_ids:
+            self._write_chunks(vector_store, [new_chunks[chunk_id] for chunk_id in added_ids], added_ids)
+        if removed_ids:
+            with index_write_lock(self.persist_directory):
+                vector_store._collection.delete(ids=removed_ids)
+
+        self._set_lexical_index(collection_name, BM25Index(list(new_chunks), [chunk.page_content for chunk in new_chunks.values()]))
+
+        return {
+            "added": [new_chunks[chunk_id] for chunk_id in added_ids],
+            "removed": len(removed_ids),
+            "unchanged": len(new_chunks) - len(added_ids)
+        }
+
+    def _query_store(self, vector_store : Any, query_embedding : List[float], fetch_k : int) -> Tuple[List[str], List[Any], np.ndarray]:
+        """Top fetch_k candidates as (ids, documents, stored vectors)"""
+        if isinstance(vector_store, NumpyIndex):
+            return vector_store.query(query_embedding, fetch_k)
+
+        collection = vector_store._collection
+        n_results = min(fetch_k, collection.count())
+        if n_results == 0:
+            return [], [], np.empty((0, 0))
+
+        result = collection.query(
+            query_embeddings=[query_embedding],
+            n_results=n_results,
+            include=["documents", "metadatas", "embeddings"]
+        )
+
+        docs = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(result["documents"][0], result["metadatas"][0])
+        ]
+        return result["ids"][0], docs, np.asarray(result["embeddings"][0], dtype=float)
+
+    def _get_by_ids(self, vector_store : Any, ids : List[str]) -> Tuple[List[Any], np.ndarray]:
+        """Documents and their stored vectors, in the order of ids"""
+        if isinstance(vector_store, NumpyIndex):
+            return vector_store.get(ids)
+
+        result = vector_store._collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+        by_id = {
+            chunk_id: (Document(page_content=text, metadata=metadata or {}), embedding)
+            for chunk_id, text, metadata, embedding in zip(result["ids"], result["documents"], result["metadatas"], result["embeddings"])
+        }
+        found = [by_id[chunk_id] for chunk_id in ids if chunk_id in by_id]
+        return [doc for doc, _ in found], np.asarray([embedding for _, embedding in found], dtype=float)
+
+    def _embed_query(self, query : str) -> Optional[List[float]]:
+        """Query embedding, None if the embedding server fails or doesn't answer within embed_timeout"""
+        future = self._embed_executor.submit(self.embedding_function.embed_query, query)
+        try:
+            return future.result(timeout=self.embed_timeout)
+        except Exception as e:
+            print(f"Query embedding failed/timed out, using lexical retrieval: {e!r}")
+            return None
+
+    def build_context(self, collection_name : str, query : str, token_budget : int, fetch_k : int = 40, lambda_mult : float = 0.6,
+                      vector_store : Optional[Any] = None, retrieval_mode : str = "hybrid") -> List[Any]:
+        """Retrieves passages for the prompt
+            Vector and BM25 rankings are fused (RRF), candidates are reranked with MMR on their stored vectors
+            (only the query gets embedded) and packed into the token budget, so the number of passages depends on the article
+            vector_store - already opened ephemeral index, otherwise the persistent collection_name is used
+        """
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {retrieval_mode}")
+
+        if vector_store is None:
             vector_store = Chroma(
                 collection_name=collection_name,
                 embedding_function=self.embedding_function,
                 persist_directory=self.persist_directory
             )
 
+        query_embedding = None
+        if retrieval_mode != "lexical":
+            query_embedding = self._embed_query(query)
+            if query_embedding is None:
+                self.generation_stats.incr("lexical_fallbacks")
+
+        rankings = []
+        candidates = {} # id -> (document, stored vector)
+
+        if query_embedding is not None:
+            ids, docs, embeddings = self._query_store(vector_store, query_embedding, fetch_k)
+            rankings.append(ids)
+            candidates.update(zip(ids, zip(docs, embeddings)))
+
+        if retrieval_mode != "vector" or query_embedding is None:
+            lexical = self._lexical_index(collection_name, vector_store)
+            lexical_ids = [chunk_id for chunk_id, _ in lexical.search(query, fetch_k)]
+            if not lexical_ids and not rankings:
+                # nothing matched lexically and there is no vector ranking - start of the article is the best guess
+                lexical_ids = lexical.ids[:fetch_k]
+            rankings.append(lexical_ids)
+
+            missing = [chunk_id for chunk_id in lexical_ids if chunk_id not in candidates]
+            if missing:
+                docs, embeddings = self._get_by_ids(vector_store, missing)
+                candidates.update(zip(missing, zip(docs, embeddings)))
+
+        fused = [(chunk_id, score) for chunk_id, score in reciprocal_rank_fusion(rankings) if chunk_id in candidates]
+        if not fused:
+            return []
+
+        docs = [candidates[chunk_id][0] for chunk_id, _ in fused]
+        embeddings = np.asarray([candidates[chunk_id][1] for chunk_id, _ in fused], dtype=float)
+        relevance = np.asarray([score for _, score in fused]) / fused[0][1]
+
+        order = mmr_order(relevance, embeddings, lambda_mult=lambda_mult)
+        return pack_context(docs, order, token_budget)
+
+    def _build_prompt(self) -> ChatPromptTemplate:
+        """Prompt used for every generation call (single deck and per-section map step)"""
+        # template = """
+        #         ROLE:
+        #         You are an academic knowledge assistant. Your mission is to transform raw text (Wikipedia data) into high-quality pedagogical materials (flashcards).
+
+        #         TASK:
+        #         Analyze the provided context and generate flashcards optimized for spaced repetition based on the user's request. Everytime, try to generate different flashcards.
+
+        #         GOALS:
+        #         1. Extract core definitions, core information, and scientific concepts.
+        #         2. Focus on single, atomic facts for better memory retention.
+        #         3. Use precise, objective academic language.
+        #         4. Output strictly as a JSON object following the format instructions below.
+
+        #         CONTEXT (SOURCE MATERIAL):
+        #         {context}
+
+        #         RULES:
+        #         - Do NOT add information that is not present in the CONTEXT documents.
+        #         - IGNORE metadata like edit dates, licensing info, or source citations, etc.
+        #         - If facts are missing, do not invent information.
+        #         - NO conversational fillers (e.g., {{"Here are your flashcards"}} etc.). Output ONLY the JSON.
+
+        #         FORMAT INSTRUCTIONS:
+        #         {format_instructions}
+
+        #         USER REQUEST:
+        #         {topic}
+        #         """
+        # prompt = ChatPromptTemplate.from_template(template)
+
+        prompt = ChatPromptTemplate.from_messages([
+            (
+                "system", """
+                ROLE:
+                You are an academic knowledge assistant. Your mission is to transform raw text (Wikipedia data) into high-quality pedagogical materials (flashcards).
+
+                GOALS:
+                1. Extract {num_cards} most fundamental facts: core definitions, core information, and scientific concepts.
+                2. Focus on single, atomic facts for better memory retention.
+                3. Use the "Minimum Information Principle": each card must be brief and focus on ONE specific piece of information.
+                4. Front should be a clear question, Back should be a concise answer.
+                5. Use precise, objective academic language.
+                6. Output strictly as a JSON object following the format instructions below.
+
+                RULES:
+                - Do NOT add information that is not present in the CONTEXT documents.
+                - IGNORE metadata like edit dates, licensing info, or source citations, etc.
+                - If facts are missing, do not invent information.
+                - NO conversational fillers (e.g., {{"Here are your flashcards"}} etc.). Output ONLY the JSON.
+
+                FORMAT INSTRUCTIONS:
+                {format_instructions}
+            """),
+            ("user","""
+                TASK:
+                Analyze the provided context and generate flashcards optimized for spaced repetition based on the user's request. Everytime, try to generate different flashcards.
+             
+                CONTEXT (SOURCE MATERIAL):
+                {context}
+
+                USER REQUEST:
+                {topic}
+            """)
+        ])
+
+        return prompt
+
+    def _generate_from_context(self, context_text : str, topic : str, num_cards : int = 5, fresh : bool = False, max_retries : int = 2,
+                               deadline : Optional[float] = None) -> List[Dict[str, str]]:
+        """Prompts the LLM with an already built context
+            Answers are cached, fresh=True bypasses the cache lookup (the new answer still gets stored)
+            Near-valid JSON is repaired locally, missing/invalid cards are re-asked at most max_retries times
+            deadline (time.monotonic()) - no new attempts/retries after it, nobody waits for them anymore
+        """
+        parser = JsonOutputParser(pydantic_object=FlashcardDeckSchema)
+        prompt = self._build_prompt()
+
+        def render(request : str, count : int):
+            return prompt.format_messages(
+                context=context_text,
+                topic=request,
+                num_cards=count,
+                format_instructions=parser.get_format_instructions()
+            )
+
+        messages = render(topic, num_cards)
+        rendered_prompt = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        params = {"temperature": self.llm.temperature, "num_ctx": self.llm.num_ctx, "num_predict": self.llm.num_predict, "format": self.llm.format}
+        cache_key = self.cache.make_key(self.model_name, rendered_prompt, params)
+
+        if not fresh:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        self.generation_stats.incr("calls")
+        cards = []
+        for attempt in range(max_retries + 1):
+            if deadline is not None and time.monotonic() >= deadline:
+                print("Latency budget exceeded, no more attempts for this section")
+                break
+
+            missing = num_cards - len(cards)
+            if attempt > 0:
+                # re-ask only for what is still missing
+                self.generation_stats.incr("retries")
+                already = "\n".join(f"- {card['front']}" for card in cards)
+                messages = render(f"{topic}\nCreate {missing} more flashcards. Do NOT repeat these questions:\n{already}", missing)
+
+            self.generation_stats.incr("attempts")
+            try:
+                text = self.llm.invoke(messages).content
+            except Exception as e:
+                print(f'Error when generating flashcards : {e}')
+                continue
+
+            data, repaired = repair_json(text)
+            if data is None:
+                self.generation_stats.incr("parse_failures")
+                continue
+            if repaired:
+                self.generation_stats.incr("repaired")
+
+            new_cards, invalid = validate_cards(data)
+            self.generation_stats.incr("invalid_cards", invalid)
+
+            seen = {card["front"].lower() for card in cards}
+            cards.extend(card for card in new_cards if card["front"].lower() not in seen)
+            cards = cards[:num_cards]
+            if len(cards) >= num_cards:
+                break
+
+        if not cards:
+            self.generation_stats.incr("failures")
+            return []
+
+        # a short deck (failed attempt / retries ran out) must not be replayed for the whole TTL
+        if len(cards) == num_cards:
+            self.cache.set(cache_key, cards)
+        return cards
+
+    def _context_budget(self, topic : str, num_cards : int) -> int:
+        """Tokens left for the context after the prompt itself and the answer
+            Prompt + context are estimated, so they only get the input window minus TOKEN_ESTIMATE_MARGIN
+        """
+        parser = JsonOutputParser(pydantic_object=FlashcardDeckSchema)
+        prompt_overhead = estimate_tokens(self._build_prompt().format(context="", topic=topic, num_cards=num_cards, format_instructions=parser.get_format_instructions()))
+        input_window = int((self.context_window - self.max_output_tokens) * (1 - TOKEN_ESTIMATE_MARGIN))
+        return input_window - prompt_overhead
+
+    def generate_flashcards(self, collection_name : str, topic : str = "Create 5 flashcards about this wikipedia page", num_cards : int = 5, fresh : bool = False,
+                            vector_store : Optional[Any] = None, retrieval_mode : str = "hybrid") -> List[Dict[str, str]]:
+        """Generates our flashcards utilizing RAG
+            Retrieves context from our vectordb and prompts the LLM
+        """
+        token_budget = self._context_budget(topic, num_cards)
+        context_docs = self.build_context(collection_name, query=f"important facts, key definitions, concepts, summary about {topic}", token_budget=token_budget,
+                                          vector_store=vector_store, retrieval_mode=retrieval_mode)
+
+        cards = self._generate_from_context(format_docs(context_docs), topic, num_cards, fresh=fresh)
+        if not cards:
+            raise ValueError("The model did not return any valid flashcards")
+
+        return cards
+
+    def generate_from_chunks(self, chunks : List[Any], topic : str, num_cards : int = 5, fresh : bool = False) -> List[Dict[str, str]]:
+        """Generates flashcards straight from the given chunks (e.g. only the changed part of an article), no retrieval"""
+        token_budget = self._context_budget(topic, num_cards)
+        context_docs = pack_context(chunks, list(range(len(chunks))), token_budget)
+
+        return self._generate_from_context(format_docs(context_docs), topic, num_cards, fresh=fresh)
+
+    def split_sections(self, chunks : List[Any], num_sections : int, token_budget : int) -> List[List[Any]]:
+        """Splits the article (its chunks in reading order) into about num_sections contiguous sections of similar size
+            A section never exceeds the token budget, with too few sections for the article there are more of them (nothing is dropped)
+        """
+        total_tokens = sum(estimate_tokens(chunk.page_content) for chunk in chunks)
+        section_tokens = min(token_budget, math.ceil(total_tokens / max(1, num_sections)))
+
+        sections = []
+        section, used = [], 0
+        for chunk in chunks:
+            cost = estimate_tokens(chunk.page_content)
+            if section and (used >= section_tokens or used + cost > token_budget):
+                sections.append(section)
+                section, used = [], 0
+            section.append(chunk)
+            used += cost
+        if section:
+            sections.append(section)
+
+        # a single chunk bigger than the budget is the only thing that can still be cut off here
+        sections = [pack_context(section, list(range(len(section))), token_budget) for section in sections]
+        return [section for section in sections if section]
+
+    def generate_deck_map_reduce(self, chunks : List[Any], title : str, deck_size : int, cards_per_section : int = 5,
+                                 max_concurrency : int = 4, latency_budget : float = 180.0, similarity_threshold : float = 0.9,
+                                 fresh : bool = False) -> List[Dict[str, str]]:
+        """Generates a large deck in a map-reduce fashion
+            map - every section of the article gets its own LLM call (at most max_concurrency at a time)
+            reduce - cards are deduplicated by embedding similarity and ranked against the topic up to deck_size
+            Sections that did not finish within latency_budget seconds are dropped
+        """
+        deadline = time.monotonic() + latency_budget
+        topic = f"Create {deck_size} flashcards about {title}"
+
+        # generate a bit more than asked for, duplicates are removed in the reduce step
+        target = math.ceil(deck_size * 1.5)
+        # enough sections for the cards and for the whole article to fit the prompts (a long article gets more, smaller calls)
+        token_budget = self._context_budget(f"Create {cards_per_section * 2} flashcards about {title}", cards_per_section * 2)
+        total_tokens = sum(estimate_tokens(chunk.page_content) for chunk in chunks)
+        num_sections = max(math.ceil(target / cards_per_section), math.ceil(total_tokens / max(1, token_budget)))
+        sections = self.split_sections(chunks, num_sections, token_budget)
+        per_section = max(1, min(cards_per_section * 2, math.ceil(target / max(1, len(sections)))))
+        # the topic of a section asks for the same number of cards as its prompt does
+        section_topic = f"Create {per_section} flashcards about {title}"
+
+        # map
+        candidates = []
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            futures = [
+                executor.submit(self._generate_from_context, format_docs(section), section_topic, per_section, fresh, deadline=deadline)
+                for section in sections
+            ]
+            done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+            if not_done:
+                print(f"Latency budget exceeded, dropping {len(not_done)} of {len(futures)} sections")
+
+            for future in futures:
+                if future in done and future.exception() is None:
+                    candidates.extend(future.result())
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        if not candidates:
+            raise ValueError("The model did not return any valid flashcards")
+
+        return self.reduce_cards(candidates, topic, deck_size, similarity_threshold)
+
+    def reduce_cards(self, cards : List[Dict[str, str]], topic : str, deck_size : int, similarity_threshold : float = 0.9) -> List[Dict[str, str]]:
+        """Dedupes the cards by embedding similarity and keeps the deck_size most relevant (and diverse) ones"""
+        if not cards:
+            return []
+
+        vectors = np.asarray(self.embedding_function.embed_documents([f"{card['front']} {card['back']}" for card in cards]), dtype=float)
+        vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+        query_vector = np.asarray(self.embedding_function.embed_query(topic), dtype=float)
+        relevance = vectors @ (query_vector / (np.linalg.norm(query_vector) + 1e-12))
+
+        kept = []
+        for i in mmr_order(relevance, vectors):
+            if kept and float((vectors[kept] @ vectors[i]).max()) >= similarity_threshold:
+                continue
+            kept.append(i)
+            if len(kept) == deck_size:
+                break
+
+        return [cards[i] for i in kept]
+            
+    def generate_deck_cards(self, chunks : List[Any], title : str, collection_name : str, deck_size : int = SINGLE_PROMPT_DECK_SIZE,
+                            latency_budget : float = 180.0, fresh : bool = False, index_mode : str = "persistent",
+                            retrieval_mode : str = "hybrid") -> List[Dict[str, str]]:
+        """Index + generate stage of the pipeline for already chunked article (used by the API and the dump ingestion)
+            index_mode="persistent" treats collection_name as a persistent article index - it is synced incrementally and kept,
+            the ephemeral modes ("memory", "numpy") build a throwaway index for this one generation
+        """
+        if index_mode not in INDEX_MODES:
+            raise ValueError(f"Unknown index mode: {index_mode}")
+
+        topic = f"Create {deck_size} flashcards about {title}"
+
+        if index_mode == "persistent":
+            self.sync_index(chunks, collection_name)
+
+        if deck_size > SINGLE_PROMPT_DECK_SIZE:
+            # map-reduce over the sections of the article, no retrieval needed
+            return self.generate_deck_map_reduce(chunks, title=title, deck_size=deck_size, latency_budget=latency_budget, fresh=fresh)
+
+        if index_mode == "persistent":
+            return self.generate_flashcards(collection_name, topic=topic, num_cards=deck_size, fresh=fresh, retrieval_mode=retrieval_mode)
+
+        # index
+        vector_store = self.index_documents(chunks, collection_name, mode=index_mode)
+        try:
+            # generate
+            return self.generate_flashcards(collection_name, topic=topic, num_cards=deck_size, fresh=fresh, vector_store=vector_store,
+                                            retrieval_mode=retrieval_mode)
+        finally:
             vector_store.delete_collection()
+            self._drop_lexical_index(collection_name)
+
+    def delete_collection(self, collection_name : str):
+        """Cleans up our vector_store collection"""
+        try:
+            with index_write_lock(self.persist_directory):
+                vector_store = Chroma(
+                    collection_name=collection_name,
+                    embedding_function=self.embedding_function,
+                    persist_directory=self.persist_directory
+                )
+                vector_store.delete_collection()
+            self._drop_lexical_index(collection_name)
             print(f"Collection {collection_name} successfully deleted")
         except Exception as e:
             print(f"Failed to delete the collection / the collection does not exist: {e}")
@@ -0,0 +1,189 @@
+from typing import Dict, Any, Optional
+from collections import defaultdict
+from contextlib import contextmanager
+import heapq
+import itertools
+import threading
+import time
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after : float):
+        super().__init__(f"Rate limit exceeded, retry in {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate : float, capacity : float):
+        self.rate = rate # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost : float = 1.0) -> float:
+        """Takes cost tokens, returns 0 on success or the seconds until enough tokens are available
+            A cost above capacity could never be paid at once - it's admitted with a full bucket and leaves the
+            bucket in debt, so the next request waits until the whole cost is paid off
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        needed = min(cost, self.capacity)
+        if self.tokens >= needed:
+            self.tokens -= cost
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+
+class FairScheduler:
+    """Admission control in front of the RAG pipeline (we have a single ollama backend)
+        - token bucket per user: rate_per_minute generations, bursts up to burst
+        - at most per_user_concurrency running generations per user and max_concurrency in total
+        - free slots go to the waiting request with the smallest virtual finish time (weighted fair queuing),
+          so a user submitting dozens of generations can't starve the others
+        - at most max_queue waiting requests (0 = unbounded), every waiting request blocks a threadpool thread
+    """
+    def __init__(self, max_concurrency : int = 2, per_user_concurrency : int = 1, rate_per_minute : float = 6.0, burst : int = 3,
+                 max_queue : int = 0):
+        self.max_concurrency = max_concurrency
+        self.per_user_concurrency = per_user_concurrency
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_queue = max_queue
+
+        self._lock = threading.Condition()
+        self._buckets : Dict[int, TokenBucket] = {}
+        self._weights : Dict[int, float] = {}
+        self._running : Dict[int, int] = defaultdict(int)
+        self._finish_tags : Dict[int, float] = defaultdict(float) # last virtual finish time per user
+        self._virtual_time = 0.0
+        self._queue = [] # heap of (finish tag, sequence, user_id)
+        self._sequence = itertools.count()
+
+        # metrics
+        self._waiting : Dict[int, int] = defaultdict(int)
+        self._wait_total : Dict[int, float] = defaultdict(float)
+        self._wait_max : Dict[int, float] = defaultdict(float)
+        self._admitted : Dict[int, int] = defaultdict(int)
+        self._rejected : Dict[int, int] = defaultdict(int)
+        self._shed : Dict[int, int] = defaultdict(int) # turned away because the queue was full
+
+    def set_weight(self, user_id : int, weight : float):
+        """Bigger weight = bigger share of the backend under contention (default 1)"""
+        with self._lock:
+            self._weights[user_id] = weight
+
+    def _can_run(self, user_id : int, entry) -> bool:
+        if sum(self._running.values()) >= self.max_concurrency:
+            return False
+        if self._running[user_id] >= self.per_user_concurrency:
+            return False
+
+        # first admissible waiting entry in fair order (users at their cap are skipped, not blocking others)
+        for candidate in sorted(self._queue):
+            if self._running[candidate[2]] < self.per_user_concurrency:
+                return candidate is entry
+        return False
+
+    def _take_tokens(self, user_id : int, cost : float):
+        bucket = self._buckets.setdefault(user_id, TokenBucket(self.rate_per_minute / 60.0, self.burst))
+        retry_after = bucket.take(cost)
+        if retry_after:
+            self._rejected[user_id] += 1
+            raise RateLimitExceeded(retry_after)
+
+    def check_rate(self, user_id : int, cost : float = 1.0):
+        """Only the token bucket (for queued background jobs), raises RateLimitExceeded"""
+        with self._lock:
+            self._take_tokens(user_id, cost)
+
+    def acquire(self, user_id : int, cost : float = 1.0, timeout : Optional[float] = None) -> float:
+        """Blocks until the user gets a slot, returns the time spent waiting
+            raises RateLimitExceeded (token bucket empty), QueueFull (right away) or QueueTimeout
+        """
+        started = time.monotonic()
+        with self._lock:
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                # before the token bucket, a request we turn away doesn't cost the user tokens
+                self._shed[user_id] += 1
+                raise QueueFull(f"Generation queue is full ({self.max_queue} waiting)")
+            self._take_tokens(user_id, cost)
+
+            # virtual finish time: a heavy user's requests get ever later tags than a light user's
+            start_tag = max(self._virtual_time, self._finish_tags[user_id])
+            finish_tag = start_tag + cost / self._weights.get(user_id, 1.0)
+            self._finish_tags[user_id] = finish_tag
+
+            entry = (finish_tag, next(self._sequence), user_id)
+            heapq.heappush(self._queue, entry)
+            self._waiting[user_id] += 1
+
+            try:
+                while not self._can_run(user_id, entry):
+                    remaining = None if timeout is None else timeout - (time.monotonic() - started)
+                    if remaining is not None and remaining <= 0:
+                        raise QueueTimeout(f"No generation slot within {timeout} s")
+                    self._lock.wait(remaining)
+            except BaseException:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._waiting[user_id] -= 1
+                self._lock.notify_all()
+                raise
+
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._waiting[user_id] -= 1
+            self._running[user_id] += 1
+            self._virtual_time = max(self._virtual_time, entry[0] - cost / self._weights.get(user_id, 1.0))
+
+            waited = time.monotonic() - started
+            self._admitted[user_id] += 1
+            self._wait_total[user_id] += waited
+            self._wait_max[user_id] = max(self._wait_max[user_id], waited)
+            return waited
+
+    def release(self, user_id : int):
+        with self._lock:
+            self._running[user_id] -= 1
+            self._lock.notify_all()
+
+    @contextmanager
+    def slot(self, user_id : int, cost : float = 1.0, timeout : Optional[float] = None):
+        self.acquire(user_id, cost, timeout)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            users = set(self._admitted) | set(self._waiting) | set(self._rejected) | set(self._running) | set(self._shed)
+            return {
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "running": sum(self._running.values()),
+                "max_concurrency": self.max_concurrency,
+                "users": {
+                    user_id: {
+                        "queued": self._waiting[user_id],
+                        "running": self._running[user_id],
+                        "admitted": self._admitted[user_id],
+                        "rejected": self._rejected[user_id],
+                        "shed": self._shed[user_id],
+                        "avg_wait": self._wait_total[user_id] / self._admitted[user_id] if self._admitted[user_id] else 0.0,
+                        "max_wait": self._wait_max[user_id],
+                        "weight": self._weights.get(user_id, 1.0)
+                    }
+                    for user_id in users
+                }
+            }
@@ -0,0 +1,160 @@
+from typing import List, Dict, Any, Optional, Tuple
+from pydantic import BaseModel, Field, ValidationError
+import json
+import re
+import threading
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_SMART_QUOTES = str.maketrans({"“": '"', "”": '"', "„": '"'})
+
+
+class FlashcardSchema(BaseModel):
+    front : str = Field(description="This is the front of the flashcard (question)")
+    back : str = Field(description="This is the back of the flashcard (answer)")
+
+class FlashcardDeckSchema(BaseModel):
+    cards : List[FlashcardSchema] = Field(description="This is our list of flashcards")
+
+
+def _close_brackets(text : str) -> str:
+    """Closes an unterminated string and all open brackets (typical for an answer cut off by num_predict).
+        If the text was cut inside a card, the unfinished card is dropped.
+    """
+    stack = []
+    in_string = False
+    escaped = False
+    last_complete = None # (position, stack) right after the last object closed inside a list
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if char == "}" and stack and stack[-1] == "[":
+                last_complete = (i + 1, list(stack))
+
+    if not stack and not in_string:
+        return text
+
+    if last_complete is not None:
+        position, stack = last_complete
+        text = text[:position]
+    elif in_string:
+        text += '"'
+
+    closers = {"{": "}", "[": "]"}
+    return text + "".join(closers[bracket] for bracket in reversed(stack))
+
+
+def repair_json(text : str) -> Tuple[Optional[Any], bool]:
+    """Cheap local repair of near-valid JSON
+        returns (parsed object or None, whether a repair was needed)
+    """
+    try:
+        return json.loads(text), False
+    except (json.JSONDecodeError, TypeError):
+        pass
+
+    cleaned = _FENCE.sub("", text.strip()).translate(_SMART_QUOTES)
+
+    # skip any chatter before/after the JSON itself
+    starts = [i for i in (cleaned.find("{"), cleaned.find("[")) if i != -1]
+    if not starts:
+        return None, True
+    cleaned = cleaned[min(starts):]
+    end = max(cleaned.rfind("}"), cleaned.rfind("]"))
+
+    for candidate in (cleaned[:end + 1], cleaned):
+        candidate = _TRAILING_COMMA.sub(r"\1", _close_brackets(candidate))
+        try:
+            return json.loads(candidate), True
+        except json.JSONDecodeError:
+            continue
+
+    return None, True
+
+
+def validate_cards(data : Any) -> Tuple[List[Dict[str, str]], int]:
+    """Validates the parsed answer against FlashcardSchema
+        returns (valid cards, number of invalid ones)
+    """
+    if isinstance(data, dict):
+        items = data.get("cards", [])
+    elif isinstance(data, list):
+        items = data
+    else:
+        return [], 0
+
+    if not isinstance(items, list):
+        return [], 1
+
+    valid = []
+    invalid = 0
+    seen = set()
+    for item in items:
+        try:
+            card = FlashcardSchema.model_validate(item)
+        except ValidationError:
+            invalid += 1
+            continue
+
+        front, back = card.front.strip(), card.back.strip()
+        if not front or not back or front.lower() in seen:
+            invalid += 1
+            continue
+
+        seen.add(front.lower())
+        valid.append({"front": front, "back": back})
+
+    return valid, invalid
+
+
+class GenerationStats:
+    """Thread safe counters of the structured generation (map-reduce calls run in parallel)
+        With a store (LLMResponseCache) the counters are kept in its SQLite file and summed over all processes
+    """
+    FIELDS = ("calls", "attempts", "parse_failures", "repaired", "invalid_cards", "retries", "failures", "lexical_fallbacks")
+    PREFIX = "generation."
+
+    def __init__(self, store : Optional[Any] = None):
+        self.store = store
+        self._lock = threading.Lock()
+        self._counts = {field: 0 for field in self.FIELDS}
+
+    def incr(self, field : str, value : int = 1):
+        if self.store is not None:
+            try:
+                self.store.incr_counter(self.PREFIX + field, value)
+            except Exception as e:
+                print(f"Failed to persist the generation counter {field}: {e}")
+            return
+
+        with self._lock:
+            self._counts[field] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        if self.store is not None:
+            stored = self.store.counters(self.PREFIX)
+            counts = {field: stored.get(field, 0) for field in self.FIELDS}
+        else:
+            with self._lock:
+                counts = dict(self._counts)
+
+        calls = counts["calls"]
+        counts["retry_rate"] = counts["retries"] / calls if calls else 0.0
+        counts["failure_rate"] = counts["failures"] / calls if calls else 0.0
+        return counts
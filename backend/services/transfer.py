@@ -0,0 +1,349 @@
+"""Streaming export and batched import of a user's decks, cards and review history
+
+Exports read the rows with server-side cursors (yield_per) and yield text chunks, so memory stays constant
+no matter how many cards the user has. Imports insert in large batches (one transaction per batch) and
+reschedule the cards from their last review afterwards. A failed import deletes the decks it created (their cards
+and review logs cascade), so an error means nothing was imported and the fixed file can simply be imported again.
+
+NDJSON is the lossless format (decks, cards and review logs, one record per line), CSV has the cards or the
+review logs, "anki" is Anki's tab separated text import format (deck, front, back).
+"""
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+from datetime import datetime, timezone, timedelta
+import csv
+import io
+import json
+
+from sqlalchemy import insert, update, delete
+from sqlmodel import Session, select
+
+from models import Deck, DeckStatus, Flashcard, ReviewLog
+from services.versions import versions
+
+BATCH_SIZE = 5000
+
+CARD_COLUMNS = ("deck_id", "deck", "card_id", "front", "back", "easiness_factor", "interval", "repetitions", "next_review_date")
+REVIEW_COLUMNS = ("card_id", "review_date", "grade", "resulting_interval", "resulting_easiness_factor")
+
+
+def _isoformat(value : Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc) # sqlite gives naive datetimes back
+    return value.isoformat()
+
+
+def _parse_datetime(value : Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+# export
+
+def _iter_decks(session : Session, user_id : int):
+    # drafts are unsaved generations, they are not part of the collection
+    return session.exec(
+        select(Deck).where(Deck.user_id == user_id, Deck.status != DeckStatus.DRAFT).order_by(Deck.id)
+    ).all()
+
+
+# plain columns instead of ORM objects, building 100k entities would dominate the export
+
+def _iter_cards(session : Session, user_id : int, batch_size : int):
+    return session.exec(
+        select(
+            Flashcard.deck_id, Deck.title, Flashcard.id, Flashcard.front, Flashcard.back,
+            Flashcard.easiness_factor, Flashcard.interval, Flashcard.repetitions, Flashcard.next_review_date
+        )
+        .join(Deck)
+        .where(Deck.user_id == user_id, Deck.status != DeckStatus.DRAFT)
+        .order_by(Flashcard.id)
+        .execution_options(yield_per=batch_size)
+    )
+
+
+def _iter_reviews(session : Session, user_id : int, batch_size : int):
+    return session.exec(
+        select(
+            ReviewLog.flashcard_id, ReviewLog.review_date, ReviewLog.grade,
+            ReviewLog.resulting_interval, ReviewLog.resulting_easiness_factor
+        )
+        .join(Flashcard)
+        .join(Deck)
+        .where(Deck.user_id == user_id, Deck.status != DeckStatus.DRAFT)
+        .order_by(ReviewLog.flashcard_id, ReviewLog.review_date)
+        .execution_options(yield_per=batch_size)
+    )
+
+
+def _chunked(lines : Iterable[str], batch_size : int) -> Iterator[str]:
+    """Joins lines into bigger chunks, one yield per row would dominate the export time"""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= batch_size:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+
+
+def _csv_line(values : Iterable[Any]) -> str:
+    output = io.StringIO()
+    csv.writer(output).writerow(values)
+    return output.getvalue()
+
+
+def export_ndjson(session : Session, user_id : int, include_reviews : bool = True, batch_size : int = BATCH_SIZE) -> Iterator[str]:
+    def lines():
+        for deck in _iter_decks(session, user_id):
+            yield json.dumps({
+                "type": "deck", "id": deck.id, "title": deck.title, "description": deck.description,
+                "status": deck.status.value, "created_at": _isoformat(deck.created_at)
+            }) + "\n"
+
+        for deck_id, _, card_id, front, back, easiness_factor, interval, repetitions, next_review_date in _iter_cards(session, user_id, batch_size):
+            yield json.dumps({
+                "type": "card", "id": card_id, "deck_id": deck_id, "front": front, "back": back,
+                "easiness_factor": easiness_factor, "interval": interval, "repetitions": repetitions,
+                "next_review_date": _isoformat(next_review_date)
+            }) + "\n"
+
+        if include_reviews:
+            for card_id, review_date, grade, resulting_interval, resulting_easiness_factor in _iter_reviews(session, user_id, batch_size):
+                yield json.dumps({
+                    "type": "review", "card_id": card_id, "review_date": _isoformat(review_date), "grade": grade,
+                    "resulting_interval": resulting_interval, "resulting_easiness_factor": resulting_easiness_factor
+                }) + "\n"
+
+    return _chunked(lines(), batch_size)
+
+
+def export_cards_csv(session : Session, user_id : int, batch_size : int = BATCH_SIZE) -> Iterator[str]:
+    def lines():
+        yield _csv_line(CARD_COLUMNS)
+        for row in _iter_cards(session, user_id, batch_size):
+            yield _csv_line((*row[:-1], _isoformat(row[-1])))
+
+    return _chunked(lines(), batch_size)
+
+
+def export_reviews_csv(session : Session, user_id : int, batch_size : int = BATCH_SIZE) -> Iterator[str]:
+    def lines():
+        yield _csv_line(REVIEW_COLUMNS)
+        for card_id, review_date, *result in _iter_reviews(session, user_id, batch_size):
+            yield _csv_line((card_id, _isoformat(review_date), *result))
+
+    return _chunked(lines(), batch_size)
+
+
+def export_anki(session : Session, user_id : int, batch_size : int = BATCH_SIZE) -> Iterator[str]:
+    """Anki "Notes in Plain Text" import file - File > Import, each deck becomes WikiCard::<title>"""
+    def clean(text : str) -> str:
+        return text.replace("\t", " ").replace("\r", " ").replace("\n", " ")
+
+    def lines():
+        yield "#separator:tab\n#html:false\n#notetype:Basic\n#deck column:1\n"
+        for _, deck_title, _, front, back, *_ in _iter_cards(session, user_id, batch_size):
+            yield f"WikiCard::{clean(deck_title)}\t{clean(front)}\t{clean(back)}\n"
+
+    return _chunked(lines(), batch_size)
+
+
+# import
+
+class _Importer:
+    """Buffers cards / review logs and writes them in batches, old (exported) ids are mapped to the new ones"""
+    def __init__(self, session : Session, user_id : int, batch_size : int):
+        self.session = session
+        self.user_id = user_id
+        self.batch_size = batch_size
+
+        self.deck_ids : Dict[Any, int] = {} # exported deck id (or deck title in CSV) -> new id
+        self.card_ids : Dict[Any, int] = {} # exported card id -> new id
+        self.pending_cards : List[Tuple[Any, Dict[str, Any]]] = []
+        self.pending_reviews : List[Dict[str, Any]] = []
+        self.schedule : Dict[int, Dict[str, Any]] = {} # new card id -> state after its last review
+
+        self.counts = {"decks": 0, "cards": 0, "reviews": 0, "skipped": 0, "rescheduled": 0}
+
+    def commit(self):
+        # every batch bumps the user's version with it, the ETags of the deck list / due cards go stale
+        versions.bump_user(self.session, self.user_id)
+        self.session.commit()
+
+    def abort(self):
+        """Removes everything imported so far (earlier batches are already committed)"""
+        self.session.rollback()
+        deck_ids = list(self.deck_ids.values())
+        for start in range(0, len(deck_ids), self.batch_size):
+            self.session.execute(delete(Deck).where(Deck.id.in_(deck_ids[start:start + self.batch_size])))
+        self.commit()
+
+    def add_deck(self, key : Any, title : str, description : Optional[str] = None, status : str = DeckStatus.ACTIVE.value,
+                 created_at : Optional[datetime] = None):
+        if not isinstance(title, str) or not isinstance(description, (str, type(None))):
+            raise TypeError("deck title and description must be strings")
+        status = DeckStatus(status) if status != DeckStatus.DRAFT.value else DeckStatus.ACTIVE
+        deck = Deck(title=title, description=description, status=status, user_id=self.user_id,
+                    created_at=created_at or datetime.now(timezone.utc))
+        self.session.add(deck)
+        self.session.flush()
+        self.deck_ids[key] = deck.id
+        self.counts["decks"] += 1
+
+    def add_card(self, key : Any, deck_key : Any, record : Dict[str, Any]):
+        deck_id = self.deck_ids.get(deck_key)
+        if deck_id is None or not record.get("front") or not record.get("back"):
+            self.counts["skipped"] += 1
+            return
+        if not isinstance(record["front"], str) or not isinstance(record["back"], str):
+            raise TypeError("card front and back must be strings") # would only fail at the batch insert otherwise
+
+        self.pending_cards.append((key, {
+            "deck_id": deck_id,
+            "front": record["front"],
+            "back": record["back"],
+            "easiness_factor": float(record.get("easiness_factor") or 2.5),
+            "interval": int(record.get("interval") or 0),
+            "repetitions": int(record.get("repetitions") or 0),
+            "next_review_date": _parse_datetime(record.get("next_review_date")) or datetime.now(timezone.utc)
+        }))
+        if len(self.pending_cards) >= self.batch_size:
+            self.flush_cards()
+
+    def add_review(self, record : Dict[str, Any]):
+        if record["card_id"] not in self.card_ids and self.pending_cards:
+            self.flush_cards() # the card is probably still in the buffer
+
+        card_id = self.card_ids.get(record["card_id"])
+        if card_id is None:
+            self.counts["skipped"] += 1
+            return
+
+        review_date = _parse_datetime(record["review_date"])
+        grade = int(record["grade"])
+        self.pending_reviews.append({
+            "flashcard_id": card_id,
+            "review_date": review_date,
+            "grade": grade,
+            "resulting_interval": int(record["resulting_interval"]),
+            "resulting_easiness_factor": float(record["resulting_easiness_factor"])
+        })
+
+        # SM-2 state after the latest review (reviews come ordered by card and date)
+        previous = self.schedule.get(card_id)
+        if previous is None or review_date >= previous["review_date"]:
+            repetitions = (previous["repetitions"] if previous else 0) + 1 if grade >= 3 else 0
+            self.schedule[card_id] = {
+                "review_date": review_date,
+                "interval": int(record["resulting_interval"]),
+                "easiness_factor": float(record["resulting_easiness_factor"]),
+                "repetitions": repetitions
+            }
+
+        if len(self.pending_reviews) >= self.batch_size:
+            self.flush_reviews()
+
+    def flush_cards(self):
+        if not self.pending_cards:
+            return
+        new_ids = self.session.scalars(
+            insert(Flashcard).returning(Flashcard.id, sort_by_parameter_order=True),
+            [row for _, row in self.pending_cards]
+        ).all()
+        for (key, _), new_id in zip(self.pending_cards, new_ids):
+            self.card_ids[key] = new_id
+        self.commit()
+
+        self.counts["cards"] += len(self.pending_cards)
+        self.pending_cards = []
+
+    def flush_reviews(self):
+        if not self.pending_reviews:
+            return
+        self.session.execute(insert(ReviewLog), self.pending_reviews)
+        self.commit()
+
+        self.counts["reviews"] += len(self.pending_reviews)
+        self.pending_reviews = []
+
+    def reschedule(self):
+        """Interval / EF / repetitions / next review of every imported card with history come from its last review"""
+        rows = [
+            {
+                "id": card_id,
+                "interval": state["interval"],
+                "easiness_factor": state["easiness_factor"],
+                "repetitions": state["repetitions"],
+                "next_review_date": state["review_date"] + timedelta(days=state["interval"])
+            }
+            for card_id, state in self.schedule.items()
+        ]
+        for start in range(0, len(rows), self.batch_size):
+            self.session.execute(update(Flashcard), rows[start:start + self.batch_size])
+            self.commit()
+        self.counts["rescheduled"] = len(rows)
+
+    def finish(self) -> Dict[str, int]:
+        self.flush_cards()
+        self.flush_reviews()
+        self.reschedule()
+        self.commit()
+        return self.counts
+
+
+def import_ndjson(session : Session, user_id : int, lines : Iterable[str], batch_size : int = BATCH_SIZE) -> Dict[str, int]:
+    """Imports an export_ndjson file (decks first, then cards, then reviews) into the collection of user_id"""
+    importer = _Importer(session, user_id, batch_size)
+
+    try:
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("not a JSON object")
+                kind = record.get("type")
+
+                if kind == "deck":
+                    importer.add_deck(record["id"], record["title"], record.get("description"), record.get("status", DeckStatus.ACTIVE.value),
+                                      _parse_datetime(record.get("created_at")))
+                elif kind == "card":
+                    importer.add_card(record["id"], record["deck_id"], record)
+                elif kind == "review":
+                    importer.add_review(record)
+                else:
+                    importer.counts["skipped"] += 1
+            except (ValueError, KeyError, TypeError) as e:
+                # wrong / missing fields (e.g. "grade": null) are the file's fault, not ours
+                raise ValueError(f"line {number}: {type(e).__name__} {e}") from e
+
+        return importer.finish()
+    except Exception:
+        importer.abort()
+        raise
+
+
+def import_cards_csv(session : Session, user_id : int, lines : Iterable[str], batch_size : int = BATCH_SIZE) -> Dict[str, int]:
+    """Imports cards from CSV with a header - deck and front/back are required, the CARD_COLUMNS scheduling fields are optional"""
+    importer = _Importer(session, user_id, batch_size)
+
+    try:
+        for number, row in enumerate(csv.DictReader(lines)):
+            try:
+                deck_title = (row.get("deck") or "Imported").strip()
+                if deck_title not in importer.deck_ids:
+                    importer.add_deck(deck_title, deck_title)
+                importer.add_card(row.get("card_id") or number, deck_title, row)
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f"row {number + 1}: {type(e).__name__} {e}") from e
+
+        return importer.finish()
+    except Exception:
+        importer.abort()
+        raise
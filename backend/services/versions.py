@@ -0,0 +1,59 @@
+"""Version counters behind the ETags of the deck and study endpoints
+
+Every write that changes what /decks/, /decks/{id}/cards or /study/due return bumps the counter of the user and/or deck,
+an unchanged counter means the client's copy is still valid and we answer 304 without loading the data.
+Counters are rows of the DataVersion table, bumped in the same transaction as the write, so every process
+(uvicorn workers, generation workers, ingest.py, the study-only API) sees the same versions.
+"""
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from models import DataVersion
+
+
+class VersionRegistry:
+    @staticmethod
+    def _bump(session : Session, scope : str) -> int:
+        # upsert, the caller commits it together with its write
+        return session.execute(
+            insert(DataVersion).values(scope=scope, version=1)
+            .on_conflict_do_update(index_elements=["scope"], set_={"version": DataVersion.version + 1})
+            .returning(DataVersion.version)
+        ).scalar_one()
+
+    def bump_user(self, session : Session, user_id : int) -> int:
+        """Returns the new version of the user"""
+        return self._bump(session, f"user:{user_id}")
+
+    def bump_deck(self, session : Session, deck_id : int, user_id : Optional[int] = None) -> Optional[int]:
+        """Deck content changed, with user_id the deck list / due cards of its owner as well (returns the new user version)"""
+        self._bump(session, f"deck:{deck_id}")
+        if user_id is not None:
+            return self.bump_user(session, user_id)
+        return None
+
+    @staticmethod
+    def _version(session : Session, scope : str) -> int:
+        return session.exec(select(DataVersion.version).where(DataVersion.scope == scope)).first() or 0
+
+    def user_version(self, session : Session, user_id : int) -> int:
+        return self._version(session, f"user:{user_id}")
+
+    def user_etag(self, session : Session, user_id : int, suffix : str = "") -> str:
+        return f'W/"u{user_id}.{self.user_version(session, user_id)}{suffix}"'
+
+    def deck_etag(self, session : Session, deck_id : int) -> str:
+        return f'W/"d{deck_id}.{self._version(session, f"deck:{deck_id}")}"'
+
+
+def etag_matches(request : Request, etag : str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+versions = VersionRegistry()
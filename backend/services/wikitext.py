@@ -0,0 +1,114 @@
+from typing import List, Tuple, Dict, Any
+import re
+
+_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+_REF = re.compile(r"<ref[^>/]*?/>|<ref[^>]*?>.*?</ref>", re.DOTALL | re.IGNORECASE)
+_DROPPED_TAGS = re.compile(r"<(gallery|math|score|syntaxhighlight|timeline)[^>]*>.*?</\1>", re.DOTALL | re.IGNORECASE)
+_HTML_TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+_FILE_LINK = re.compile(r"\[\[(?:File|Image|Category|Plik|Kategoria):", re.IGNORECASE)
+_INTERNAL_LINK = re.compile(r"\[\[(?:[^\]|]*\|)?([^\]]*)\]\]")
+_EXTERNAL_LINK = re.compile(r"\[(?:https?:)?//[^\s\]]+(?:\s([^\]]*))?\]")
+_EMPHASIS = re.compile(r"'{2,}")
+_HEADING = re.compile(r"^(={2,6})\s*(.+?)\s*\1\s*$", re.MULTILINE)
+_LIST_MARK = re.compile(r"^[*#:;]+\s*", re.MULTILINE)
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+# sections that don't contain anything worth a flashcard
+SKIPPED_SECTIONS = {"see also", "references", "external links", "further reading", "notes", "bibliography", "sources", "citations"}
+
+
+def _strip_nested(text : str, opening : str, closing : str) -> str:
+    """Removes (possibly nested) blocks like {{templates}} or {| tables |}"""
+    out = []
+    depth = 0
+    i = 0
+    while i < len(text):
+        if text.startswith(opening, i):
+            depth += 1
+            i += len(opening)
+        elif depth and text.startswith(closing, i):
+            depth -= 1
+            i += len(closing)
+        else:
+            if not depth:
+                out.append(text[i])
+            i += 1
+
+    return "".join(out)
+
+
+def _strip_file_links(text : str) -> str:
+    """Removes [[File:...]] / [[Category:...]] links, their captions can contain nested links"""
+    while True:
+        match = _FILE_LINK.search(text)
+        if not match:
+            return text
+
+        depth = 0
+        i = match.start()
+        while i < len(text):
+            if text.startswith("[[", i):
+                depth += 1
+                i += 2
+            elif text.startswith("]]", i):
+                depth -= 1
+                i += 2
+                if depth == 0:
+                    break
+            else:
+                i += 1
+
+        text = text[:match.start()] + text[i:]
+
+
+def wikitext_to_plain(text : str) -> str:
+    """Converts wikitext markup to plain text (good enough for chunking and embedding, not a full parser)"""
+    text = _COMMENT.sub("", text)
+    text = _REF.sub("", text)
+    text = _DROPPED_TAGS.sub("", text)
+    text = _strip_nested(text, "{{", "}}")
+    text = _strip_nested(text, "{|", "|}")
+    text = _strip_file_links(text)
+    text = _INTERNAL_LINK.sub(r"\1", text)
+    text = _EXTERNAL_LINK.sub(lambda m: m.group(1) or "", text)
+    text = _EMPHASIS.sub("", text)
+    text = _HTML_TAG.sub("", text)
+    text = _LIST_MARK.sub("", text)
+    text = text.replace("&nbsp;", " ")
+
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def wikitext_to_sections(title : str, text : str) -> List[Tuple[str, str]]:
+    """Splits an article into (section title, plain text) pairs, the lead section gets the article title"""
+    sections = []
+    position = 0
+    section_title = title
+
+    for match in _HEADING.finditer(text):
+        sections.append((section_title, text[position:match.start()]))
+        section_title = match.group(2).strip("= ")
+        position = match.end()
+    sections.append((section_title, text[position:]))
+
+    plain_sections = []
+    for section_title, body in sections:
+        if section_title.lower() in SKIPPED_SECTIONS:
+            continue
+
+        plain = wikitext_to_plain(body)
+        if plain:
+            plain_sections.append((wikitext_to_plain(section_title), plain))
+
+    return plain_sections
+
+
+def parse_page(page : Dict[str, Any]) -> Dict[str, Any]:
+    """Process pool entry point - parses one <page> of the dump"""
+    return {
+        "ordinal": page["ordinal"],
+        "id": page["id"],
+        "title": page["title"],
+        "revision_id": page["revision_id"],
+        "sections": wikitext_to_sections(page["title"], page["text"])
+    }
@@ -0,0 +1,272 @@
+"""Deck generation in dedicated worker processes
+
+The API process only puts GenerationJob rows into SQLite, the workers claim them one at a time and run the
+whole RAG pipeline (HTML parsing, chunking, blocking LLM calls) outside of uvicorn, so the study endpoints
+don't compete with it for the GIL and the threadpool.
+
+A claimed job holds a lease the worker keeps extending while it runs. Only jobs whose lease expired are queued
+again, so several pools (uvicorn --workers N) sharing the database don't take over each other's running jobs.
+"""
+from typing import Optional, Dict, Any
+from datetime import datetime, timezone, timedelta
+from contextlib import contextmanager
+import multiprocessing
+import threading
+import json
+import os
+import time
+
+import psutil
+
+from sqlalchemy import text, bindparam, DateTime
+from sqlmodel import Session
+
+from database import engine
+from models import Deck, GenerationJob, JobStatus
+
+
+def enqueue_job(session : Session, deck : Deck, params : Dict[str, Any]) -> GenerationJob:
+    job = GenerationJob(payload=json.dumps(params), user_id=deck.user_id, deck_id=deck.id)
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
+def claim_job(session : Session, lease_seconds : float = 60, per_user_concurrency : int = 0) -> Optional[GenerationJob]:
+    """Atomically moves a queued job to running (safe with several worker processes)
+        Users with the fewest running jobs go first, so one user's backlog doesn't block everybody else
+        Users already running per_user_concurrency jobs are skipped (0 = no cap) - queued jobs don't pass the FairScheduler
+    """
+    running = "(SELECT COUNT(*) FROM generationjob r WHERE r.user_id = q.user_id AND r.status = :running)"
+    user_cap = f"AND {running} < :per_user " if per_user_concurrency > 0 else ""
+    now = datetime.now(timezone.utc)
+    row = session.execute(
+        text(
+            "UPDATE generationjob SET status = :running, worker_pid = :pid, started_at = :now, lease_expires_at = :lease, attempts = attempts + 1 "
+            f"WHERE id = (SELECT q.id FROM generationjob q WHERE q.status = :queued {user_cap}ORDER BY {running}, q.id LIMIT 1) "
+            "RETURNING id"
+        ).bindparams(bindparam("now", type_=DateTime()), bindparam("lease", type_=DateTime())),
+        {"running": JobStatus.RUNNING.name, "queued": JobStatus.QUEUED.name, "pid": os.getpid(),
+         "now": now, "lease": now + timedelta(seconds=lease_seconds), "per_user": per_user_concurrency}
+    ).first()
+    session.commit()
+
+    return session.get(GenerationJob, row[0]) if row else None
+
+
+def requeue_expired_jobs(session : Session, max_attempts : int = 3) -> Dict[str, int]:
+    """Running jobs whose worker stopped extending the lease (crashed, killed) go back to the queue
+        A job that already used max_attempts claims probably kills its workers (OOM) - it fails instead
+        (its draft deck is left to the garbage collection)
+    """
+    expired = "status = :running AND (lease_expires_at IS NULL OR lease_expires_at < :now)"
+    params = {"running": JobStatus.RUNNING.name, "now": datetime.now(timezone.utc), "max_attempts": max_attempts}
+
+    failed = session.execute(
+        text(
+            "UPDATE generationjob SET status = :failed, worker_pid = NULL, lease_expires_at = NULL, finished_at = :now, "
+            f"error = 'Worker died ' || attempts || ' times running the job' WHERE {expired} AND attempts >= :max_attempts"
+        ).bindparams(bindparam("now", type_=DateTime())),
+        {**params, "failed": JobStatus.FAILED.name}
+    )
+    requeued = session.execute(
+        text(f"UPDATE generationjob SET status = :queued, worker_pid = NULL, lease_expires_at = NULL WHERE {expired}")
+        .bindparams(bindparam("now", type_=DateTime())),
+        {**params, "queued": JobStatus.QUEUED.name}
+    )
+    session.commit()
+    return {"requeued": requeued.rowcount, "failed": failed.rowcount}
+
+
+def _rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def _abort_job(job_id : int, draft_deck_id : Optional[int], error : str):
+    with Session(engine) as session:
+        session.execute(
+            text("UPDATE generationjob SET status = :failed, error = :error, finished_at = :now, lease_expires_at = NULL WHERE id = :id")
+            .bindparams(bindparam("now", type_=DateTime())),
+            {"failed": JobStatus.FAILED.name, "error": error, "now": datetime.now(timezone.utc), "id": job_id}
+        )
+        deck = session.get(Deck, draft_deck_id) if draft_deck_id is not None else None
+        if deck is not None:
+            session.delete(deck)
+        session.commit()
+
+
+@contextmanager
+def _watch_job(job_id : int, lease_seconds : float, memory_limit_mb : int = 0, draft_deck_id : Optional[int] = None):
+    """Background thread while the job runs - extends its lease and enforces memory_limit_mb
+        A job can't be interrupted from another thread, above the limit the job is failed and the whole worker exits
+        (the pool starts a new one)
+    """
+    stop = threading.Event()
+
+    def watch():
+        next_extension = time.monotonic() + lease_seconds / 3
+        while not stop.wait(min(1.0, lease_seconds / 3)):
+            if memory_limit_mb and _rss_mb() > memory_limit_mb:
+                error = f"Job exceeded the worker memory limit of {memory_limit_mb} MB"
+                print(f"Generation worker {os.getpid()}: {error}, exiting")
+                try:
+                    _abort_job(job_id, draft_deck_id, error)
+                finally:
+                    os._exit(1)
+
+            if time.monotonic() < next_extension:
+                continue
+            next_extension = time.monotonic() + lease_seconds / 3
+            try:
+                with Session(engine) as session:
+                    session.execute(
+                        text("UPDATE generationjob SET lease_expires_at = :lease WHERE id = :id AND worker_pid = :pid")
+                        .bindparams(bindparam("lease", type_=DateTime())),
+                        {"lease": datetime.now(timezone.utc) + timedelta(seconds=lease_seconds), "id": job_id, "pid": os.getpid()}
+                    )
+                    session.commit()
+            except Exception as e:
+                print(f"Failed to extend the lease of job {job_id}: {e}")
+
+    thread = threading.Thread(target=watch, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def wait_for_job(job_id : int, timeout : float, poll_interval : float = 0.5) -> GenerationJob:
+    """Blocks until the job is finished or the timeout passes, returns the last seen state"""
+    deadline = time.monotonic() + timeout
+    while True:
+        with Session(engine) as session:
+            job = session.get(GenerationJob, job_id)
+            if job.status in (JobStatus.DONE, JobStatus.FAILED) or time.monotonic() >= deadline:
+                return job
+        time.sleep(poll_interval)
+
+
+def run_job(session : Session, rag_service : Any, job : GenerationJob, lease_seconds : float = 60, memory_limit_mb : int = 0):
+    from services.generation import run_generation, run_refresh
+
+    params = json.loads(job.payload)
+    refresh = params.get("kind") == "refresh"
+    deck = session.get(Deck, job.deck_id) if job.deck_id else None
+    try:
+        if deck is None:
+            raise ValueError("Deck of the job does not exist anymore")
+
+        with _watch_job(job.id, lease_seconds, memory_limit_mb, draft_deck_id=None if refresh else deck.id):
+            if refresh:
+                job.result = json.dumps(run_refresh(session, rag_service, deck, params.get("regenerate", False)))
+            else:
+                run_generation(session, rag_service, deck, params)
+        job.status = JobStatus.DONE
+    except Exception as e:
+        session.rollback()
+        # cleanup if sth failed (only the draft of a generation, a refreshed deck stays)
+        if deck is not None and not refresh:
+            session.delete(deck)
+        job.status = JobStatus.FAILED
+        job.error = str(e)
+
+    job.finished_at = datetime.now(timezone.utc)
+    job.lease_expires_at = None
+    session.add(job)
+    session.commit()
+
+
+def worker_main(poll_interval : float, memory_limit_mb : int, max_jobs : int, lease_seconds : float = 60,
+                per_user_concurrency : int = 0):
+    """Entry point of a worker process
+        The worker exits (and gets replaced by the pool) after max_jobs jobs or when its RSS exceeds memory_limit_mb
+        (checked during a job as well, see _watch_job)
+    """
+    from services.generation import build_rag_service
+
+    rag_service = build_rag_service()
+    done = 0
+
+    while max_jobs <= 0 or done < max_jobs:
+        with Session(engine) as session:
+            job = claim_job(session, lease_seconds, per_user_concurrency)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            run_job(session, rag_service, job, lease_seconds, memory_limit_mb)
+            done += 1
+
+        if memory_limit_mb and _rss_mb() > memory_limit_mb:
+            print(f"Generation worker {os.getpid()} exceeded {memory_limit_mb} MB, recycling")
+            return
+
+
+class WorkerPool:
+    """Fixed number of generation worker processes, dead (or recycled) workers are replaced by a supervisor thread"""
+    def __init__(self, workers : int, poll_interval : float = 0.5, memory_limit_mb : int = 0, max_jobs : int = 50,
+                 lease_seconds : float = 60, max_attempts : int = 3, per_user_concurrency : int = 0):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker_args = (poll_interval, memory_limit_mb, max_jobs, lease_seconds, per_user_concurrency)
+
+        self._context = multiprocessing.get_context("spawn") # don't fork the uvicorn process with its threads
+        self._processes = []
+        self._stop = threading.Event()
+        self._supervisor = None
+
+    def _spawn(self) -> multiprocessing.Process:
+        process = self._context.Process(target=worker_main, args=self.worker_args, daemon=True)
+        process.start()
+        return process
+
+    def _requeue_expired_jobs(self):
+        # jobs of any pool, but only after their lease ran out - a running job of another process keeps its lease fresh
+        try:
+            with Session(engine) as session:
+                expired = requeue_expired_jobs(session, self.max_attempts)
+            if any(expired.values()):
+                print(f"Generation jobs with an expired lease: {expired}")
+        except Exception as e:
+            print(f"Failed to requeue expired generation jobs: {e}")
+
+    def _supervise(self):
+        last_check = time.monotonic()
+        while not self._stop.wait(1.0):
+            for i, process in enumerate(self._processes):
+                if not process.is_alive():
+                    self._processes[i] = self._spawn()
+
+            if time.monotonic() - last_check >= self.lease_seconds / 2:
+                self._requeue_expired_jobs()
+                last_check = time.monotonic()
+
+    def start(self):
+        self._requeue_expired_jobs()
+        self._processes = [self._spawn() for _ in range(self.workers)]
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+
+    def stop(self, timeout : float = 5.0):
+        self._stop.set()
+        if self._supervisor:
+            self._supervisor.join()
+
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with Session(engine) as session:
+            rows = session.execute(text("SELECT status, COUNT(*) FROM generationjob GROUP BY status")).all()
+
+        return {
+            "workers": self.workers,
+            "alive": sum(process.is_alive() for process in self._processes),
+            "jobs": {status.lower(): count for status, count in rows}
+        }
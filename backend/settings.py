@@ -0,0 +1,53 @@
+import os
+
+def _seconds(value : str) -> int:
+    """'30m' / '2h' / '45s' / '600' -> seconds (-1 stays -1 = keep forever)"""
+    units = {"s": 1, "m": 60, "h": 3600}
+    value = value.strip().lower()
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+# "full" - all endpoints, "study" - study-only process that never imports the RAG stack (generation returns 503)
+API_MODE = os.getenv("WIKICARD_API_MODE", "full")
+
+MODEL_NAME = os.getenv("WIKICARD_MODEL", "llama3.1")
+
+# the API processes, the generation workers and ingest.py share this directory, writes are serialized with a file lock
+# (services/locks.py) - with many workers writing at once a Chroma server is the better option
+CHROMA_DIRECTORY = os.getenv("WIKICARD_CHROMA_DIR", "./chroma_db")
+LLM_CACHE_PATH = os.getenv("WIKICARD_LLM_CACHE", "llm_cache.db")
+
+# how long ollama keeps our models loaded after the last request
+MODEL_KEEP_ALIVE = _seconds(os.getenv("WIKICARD_KEEP_ALIVE", "30m"))
+
+# warm up the models on startup and ping them periodically so they don't get unloaded (0 disables the heartbeat)
+WARM_UP_MODELS = os.getenv("WIKICARD_WARM_UP", "1") == "1" and API_MODE != "study"
+MODEL_HEARTBEAT_SECONDS = _seconds(os.getenv("WIKICARD_MODEL_HEARTBEAT", "5m"))
+
+# deck generation in separate worker processes (0 = run the pipeline inside the API process)
+GENERATION_WORKERS = int(os.getenv("WIKICARD_GENERATION_WORKERS", "0"))
+WORKER_MEMORY_LIMIT_MB = int(os.getenv("WIKICARD_WORKER_MEMORY_LIMIT_MB", "0")) # job is failed and the worker recycled above this RSS, 0 = no limit
+WORKER_MAX_JOBS = int(os.getenv("WIKICARD_WORKER_MAX_JOBS", "50")) # jobs before a worker is recycled, 0 = never
+WORKER_POLL_SECONDS = float(os.getenv("WIKICARD_WORKER_POLL_SECONDS", "0.5"))
+WORKER_LEASE_SECONDS = float(os.getenv("WIKICARD_WORKER_LEASE_SECONDS", "60")) # running jobs whose lease expired are queued again
+WORKER_MAX_ATTEMPTS = int(os.getenv("WIKICARD_WORKER_MAX_ATTEMPTS", "3")) # ... until they were claimed this many times, then they fail
+GENERATION_TIMEOUT_SECONDS = float(os.getenv("WIKICARD_GENERATION_TIMEOUT", "600")) # how long /decks/generate waits for a worker
+
+# fair sharing of the ollama backend between users
+GENERATION_MAX_CONCURRENCY = int(os.getenv("WIKICARD_GENERATION_MAX_CONCURRENCY", "2"))
+USER_GENERATION_CONCURRENCY = int(os.getenv("WIKICARD_USER_GENERATION_CONCURRENCY", "1"))
+USER_GENERATIONS_PER_MINUTE = float(os.getenv("WIKICARD_USER_GENERATIONS_PER_MINUTE", "6"))
+USER_GENERATION_BURST = int(os.getenv("WIKICARD_USER_GENERATION_BURST", "3"))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("WIKICARD_GENERATION_QUEUE_TIMEOUT", "300")) # max wait for a free slot
+GENERATION_MAX_QUEUE = int(os.getenv("WIKICARD_GENERATION_MAX_QUEUE", "8")) # more waiting requests get a 503 right away, 0 = unbounded
+
+# background garbage collection (0 disables the periodic run, POST /maintenance/run still works)
+MAINTENANCE_INTERVAL_SECONDS = _seconds(os.getenv("WIKICARD_MAINTENANCE_INTERVAL", "6h"))
+DRAFT_TTL_SECONDS = _seconds(os.getenv("WIKICARD_DRAFT_TTL", "24h")) # unsaved drafts older than this are deleted
+ARCHIVE_RETENTION_DAYS = int(os.getenv("WIKICARD_ARCHIVE_RETENTION_DAYS", "30")) # archived decks without reviews for this long are deleted
+JOB_RETENTION_DAYS = int(os.getenv("WIKICARD_JOB_RETENTION_DAYS", "7"))
+VACUUM_PAGES = int(os.getenv("WIKICARD_VACUUM_PAGES", "0")) # free pages released per run, 0 = all
+
+# users whose due-card queues are kept in memory by the study endpoints
+DUE_CACHE_MAX_USERS = int(os.getenv("WIKICARD_DUE_CACHE_MAX_USERS", "1000"))
@@ -2,6 +2,8 @@ import streamlit as st
 from typing import Tuple, List, Dict, Any
 import httpx
 
+from api_client import cached_get
+
 API_URL = "http://127.0.0.1:8000"
 st.set_page_config(page_title="RAG Flashcards", layout="wide")
 
@@ -9,7 +11,7 @@ def fetch_decks_and_due_count() -> Tuple[List[Dict[str, Any]], int]:
     try:
         with httpx.Client() as client:
             # hardcoded user id = 1, we don't have login/registration
-            response = client.get(f"{API_URL}/decks/?user_id=1")
+            response = cached_get(client, f"{API_URL}/decks/?user_id=1")
             if response.status_code == 200:
                 decks = response.json()
             else:
@@ -17,7 +19,7 @@ def fetch_decks_and_due_count() -> Tuple[List[Dict[str, Any]], int]:
                 st.error("Failed to fetch decks.")
                 
             # fetch Due Count
-            due_response = client.get(f"{API_URL}/study/due?user_id=1")
+            due_response = cached_get(client, f"{API_URL}/study/due?user_id=1")
             due_count = len(due_response.json()) if due_response.status_code == 200 else 0
     except Exception as e:
         st.error(f"Could not connect to backend: {e}")
@@ -0,0 +1,18 @@
+import streamlit as st
+import httpx
+
+def cached_get(client: httpx.Client, url: str) -> httpx.Response:
+    """GET with If-None-Match - on 304 the body is taken from the copy kept in the session state,
+    so streamlit reruns don't download (and the backend doesn't rebuild) unchanged decks / due cards
+    """
+    cache = st.session_state.setdefault("etag_cache", {}) # url -> (etag, json body)
+
+    headers = {"If-None-Match": cache[url][0]} if url in cache else {}
+    response = client.get(url, headers=headers)
+
+    if response.status_code == 304 and url in cache:
+        return httpx.Response(200, json=cache[url][1], headers={"ETag": cache[url][0]}, request=response.request)
+
+    if response.status_code == 200 and "etag" in response.headers:
+        cache[url] = (response.headers["etag"], response.json())
+    return response
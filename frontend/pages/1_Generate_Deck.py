@@ -10,7 +10,7 @@ def generate_deck():
         with httpx.Client(timeout=300.0) as client:
             response = client.post(
                 f"{API_URL}/decks/generate",
-                json={"url": url_input, "user_id": 1}
+                json={"url": url_input, "user_id": 1, "deck_size": deck_size, "fresh": fresh}
                 )
             if response.status_code == 200:
                 st.session_state.generated_deck = response.json()
@@ -51,6 +51,8 @@ if "generated_deck" not in st.session_state:
     st.session_state.generated_deck = None
 
 url_input = st.text_input("Wikipedia URL", placeholder="https://en.wikipedia.org/wiki/Spaced_repetition")
+deck_size = st.number_input("Number of flashcards", min_value=1, max_value=200, value=5, step=1)
+fresh = st.checkbox("Generate fresh flashcards (skip cached answers)")
 
 if st.button("Generate Flashcards", type="primary"):
     if not url_input:
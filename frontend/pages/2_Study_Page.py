@@ -1,13 +1,15 @@
 import streamlit as st
 import httpx
 
+from api_client import cached_get
+
 API_URL = "http://127.0.0.1:8000"
 st.set_page_config(page_title="Study Session", layout="centered")
 
 def fetch_study_queue():
     try:
         with httpx.Client() as client:
-            res = client.get(f"{API_URL}/study/due?user_id=1")
+            res = cached_get(client, f"{API_URL}/study/due?user_id=1")
             if res.status_code == 200:
                 current_api_queue = res.json()
 
@@ -2,6 +2,8 @@ import streamlit as st
 from typing import List, Dict, Any
 import httpx
 
+from api_client import cached_get
+
 API_URL = "http://127.0.0.1:8000"
 
 def next_card():
@@ -21,7 +23,7 @@ def fetch_decks() -> List[Dict[str, Any]]:
     try:
         with httpx.Client() as client:
             # hardcoded user id = 1, we don't have login/registration
-            response = client.get(f"{API_URL}/decks/?user_id=1")
+            response = cached_get(client, f"{API_URL}/decks/?user_id=1")
             if response.status_code == 200:
                 decks = response.json()
             else:
@@ -35,7 +37,7 @@ def fetch_decks() -> List[Dict[str, Any]]:
 def load_cards(deck_id : int, deck_title : str):
     try:
         with httpx.Client() as client:
-            res = client.get(f"{API_URL}/decks/{deck_id}/cards")
+            res = cached_get(client, f"{API_URL}/decks/{deck_id}/cards")
             if res.status_code == 200:
                 st.session_state.cards = res.json()
                 st.session_state.current_card_index = 0